@@ -0,0 +1,427 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+import gitstat
+import report
+import pygit2 as git
+import dateutil.parser
+import sys, os, io, re, time, json, random, tempfile, platform, argparse
+from datetime import datetime, timezone, timedelta
+
+# extensions of the synthetic files (weights of the mix can be changed with --mix)
+FILEEXT_MIX = {
+    'text': sorted(gitstat.FILEEXT_TEXT),
+    'code': sorted(gitstat.FILEEXT_CODE),
+    'data': sorted(gitstat.FILEEXT_DATA),
+    'figure': sorted(gitstat.FILEEXT_FIGURE_VECTOR | gitstat.FILEEXT_FIGURE_BITMAP_LOSSLESS | gitstat.FILEEXT_FIGURE_BITMAP_LOSSY),
+    'binary': sorted(gitstat.FILEEXT_BINARY),
+}
+DEFAULT_MIX = {'text': 4, 'code': 4, 'data': 1, 'figure': 1, 'binary': 0.5}
+SYNTHETIC_START = datetime(2017, 9, 1, tzinfo=timezone.utc) # time of the first commit
+
+def count_hunks_regex(patch_hunks):
+    '''Reference counting (re.findall on every decoded line), as gitstat did before count_words()'''
+    lines_inserted, lines_deleted, words_inserted, words_deleted = 0, 0, 0, 0
+    for hunk in patch_hunks:
+        for line in hunk.lines:
+            words_diff = len(re.findall(gitstat.PATTERN_WORD, line.content))
+            if words_diff == 0:         continue # exclude empty line, whitespace change, single linebreak
+            if line.origin == '+':      lines_inserted += 1; words_inserted += words_diff
+            elif line.origin == '-':    lines_deleted += 1;  words_deleted += words_diff
+    return lines_inserted, lines_deleted, words_inserted, words_deleted
+
+def collect_patches(repo, max_commits):
+    '''Patches of text and code files (criteria 0, 1) in the latest non-merge commits'''
+    patches = []
+    for i, commit in enumerate(repo.walk(repo.head.target)):
+        if i >= max_commits: break
+        if len(commit.parent_ids) != 1: continue
+        for patch in repo.diff(commit.parents[0], commit):
+            fileext = os.path.splitext(patch.delta.new_file.path)[1].lower()
+            if gitstat._get_criteria(fileext) in (0, 1):
+                patches.append(patch)
+    return patches
+
+def bench_wordcount(repo, max_commits=1000, repeat=3):
+    '''Check that the counting engines give the same counts as the regex, and time them
+
+    Returns:
+        ret (bool): True if all the counts match
+    '''
+    patches = collect_patches(repo, max_commits)
+    print('Patches of text and code:', len(patches))
+    engines = [
+        ('regex (hunks)', lambda patch: count_hunks_regex(patch.hunks)),
+        ('count_words (hunks)', lambda patch: gitstat._count_hunks(patch.hunks)),
+        ('count_words (patch.data)', lambda patch: gitstat._count_patch(patch.data)),
+    ]
+    # check counts
+    n_mismatch = 0
+    for patch in patches:
+        expected = engines[0][1](patch)
+        for name, engine in engines[1:]:
+            counts = engine(patch)
+            if counts != expected:
+                n_mismatch += 1
+                print('Mismatch in %s (%s): %s != %s' % (patch.delta.new_file.path, name, counts, expected))
+    # time
+    for name, engine in engines:
+        t = min(_time(engine, patches) for i in range(repeat))
+        print('  %-26s %8.3f s' % (name, t))
+    print('Counts %s' % ('match' if n_mismatch == 0 else 'mismatch (%d)' % n_mismatch))
+    return n_mismatch == 0
+
+def bench_profiles(repo, max_commits=1000, repeat=3):
+    '''Compare the stats of diff_commit() with each diff profile to the legacy profile, and time them
+
+    The stats of the profiles which should give the same scores (all but
+    whitespace) are checked; the number of files counted differently is printed
+    for the others.
+
+    Returns:
+        ret (bool): True if the stats of the equivalent profiles match
+    '''
+    commits = [commit for i, commit in zip(range(max_commits), repo.walk(gitstat.get_target(repo), git.GIT_SORT_TIME))
+        if len(commit.parent_ids) == 1]
+    print('Non-merge commits:', len(commits))
+    expected = [gitstat.diff_commit(repo, commit, gitstat.DiffFilter(profile='legacy')) for commit in commits]
+    ret = True
+    for profile in gitstat.DIFF_PROFILES:
+        diff_filter = gitstat.DiffFilter(profile=profile)
+        gitstat.metrics.clear()
+        t = min(_time(lambda commit: gitstat.diff_commit(repo, commit, diff_filter), commits) for i in range(repeat))
+        n_lines = gitstat.metrics.counters['lines scanned'] // repeat if len(commits) > 0 else 0
+        n_mismatch = 0
+        for commit, filestats, expected_filestats in zip(commits, [gitstat.diff_commit(repo, commit, diff_filter) for commit in commits], expected):
+            for filestat, expected_filestat in zip(filestats, expected_filestats):
+                if filestat != expected_filestat:
+                    n_mismatch += 1
+                    if profile != 'whitespace': print('Mismatch in %s of %s (%s): %s != %s' % (filestat[0], commit.id, profile, filestat, expected_filestat))
+        if profile != 'whitespace' and n_mismatch > 0: ret = False
+        print('  %-26s %8.3f s %10d lines, %d files counted differently' % (profile, t, n_lines, n_mismatch))
+    print('Stats %s' % ('match' if ret else 'mismatch'))
+    return ret
+
+# edits around blank lines (before, after), which libgit2 may count differently with some flags
+BLANK_LINE_EDITS = [
+    ('a\nb\nc\n', 'a\nb\n\n'), ('a\nb\n\n', 'a\nb\n\nc\n'), ('a\n\nb\n', 'a\nb\n'), ('a\nb\n', 'a\n\nb\n'),
+    ('a\n\n\nb\n', 'a\n\nc\nb\n'), ('\n\n', 'c\n\n'), ('a\n', '\n\na\n'), ('a b\n\n', 'a\n\nb\n'),
+]
+
+def blank_lines_repo(path):
+    '''Bare repository with a commit for each edit of BLANK_LINE_EDITS, with and without the last newline'''
+    repo = git.init_repository(path, bare=True)
+    signature = git.Signature('Author', 'author@example.com', int(SYNTHETIC_START.timestamp()), 0)
+    edits = [(before[:len(before) - i], after[:len(after) - j]) for before, after in BLANK_LINE_EDITS for i in (0, 1) for j in (0, 1)]
+    parents = []
+    for i, (before, after) in enumerate(edits):
+        for data in (before, after):
+            builder = repo.TreeBuilder()
+            builder.insert('edit%d.md' % i, repo.create_blob(data.encode()), git.GIT_FILEMODE_BLOB)
+            parents = [repo.create_commit(None, signature, signature, 'Edit %d' % i, builder.write(), parents)]
+    repo.references.create('refs/heads/master', parents[0], force=True)
+    return repo
+
+def parse_diary_dateutil(data):
+    '''Reference parsing (dateutil on every heading), as gitstat did before parse_date()'''
+    dates = []
+    for line in io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', errors='replace'):
+        if line.startswith('#'):
+            try: dates.append(dateutil.parser.parse(line, fuzzy=True).date())
+            except ValueError: pass
+    return dates
+
+def bench_diary(paths, repeat=3):
+    '''Check that parse_diary() gives the same dates as dateutil for the diaries, and time them
+
+    Returns:
+        ret (bool): True if all the dates match
+    '''
+    diaries = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            diaries.append((path, f.read()))
+    n_headings = sum(sum(1 for line in data.splitlines() if line.startswith(b'#')) for path, data in diaries)
+    n_fast = sum(sum(1 for line in data.decode('utf-8', 'replace').splitlines() if line.startswith('#') and gitstat.parse_date(line) is not None)
+        for path, data in diaries)
+    print('Diaries: %d, headings: %d, parsed by regex: %d' % (len(diaries), n_headings, n_fast))
+    engines = [
+        ('dateutil', parse_diary_dateutil),
+        ('parse_diary', gitstat.parse_diary),
+    ]
+    # check dates
+    n_mismatch = 0
+    for path, data in diaries:
+        expected = engines[0][1](data)
+        for name, engine in engines[1:]:
+            dates = engine(data)
+            if dates != expected:
+                n_mismatch += 1
+                print('Mismatch in %s (%s): %s != %s' % (path, name, dates, expected))
+    # time
+    for name, engine in engines:
+        t = min(_time(engine, [data for path, data in diaries]) for i in range(repeat))
+        print('  %-26s %8.3f s' % (name, t))
+    print('Dates %s' % ('match' if n_mismatch == 0 else 'mismatch (%d)' % n_mismatch))
+    return n_mismatch == 0
+
+class SyntheticRepo:
+    '''Build a reproducible bare repository with pygit2
+
+    Every commit of a random author modifies a few files (lines inserted, deleted
+    or replaced in text files, new content of binary files), or appends a dated
+    heading to the diary of the author (Diary/<author>.md). Commits are one hour
+    apart, some of them are merges.
+
+    Example:
+        SyntheticRepo(n_commits=1000, seed=0).build('/tmp/bench/repo.git')
+
+    Args:
+        n_commits (int): Number of commits
+        n_authors (int): Number of authors (committer emails)
+        n_files (int): Number of files, in 8 folders
+        line_length (int): Mean number of characters of a line
+        max_lines (int): Lines are deleted from the text files longer than it
+        mix (dict): Weights of the kinds of files (keys of FILEEXT_MIX)
+        merge_every (int): A merge commit every n commits
+        seed (int):
+    '''
+    def __init__(self, n_commits, n_authors=10, n_files=50, line_length=60, max_lines=300, mix=DEFAULT_MIX, merge_every=100, seed=0):
+        self.n_commits = n_commits
+        self.n_authors = n_authors
+        self.n_files = n_files
+        self.line_length = line_length
+        self.max_lines = max_lines
+        self.mix = mix
+        self.merge_every = merge_every
+        self.seed = seed
+
+    def params(self):
+        return dict(n_commits=self.n_commits, n_authors=self.n_authors, n_files=self.n_files,
+            line_length=self.line_length, max_lines=self.max_lines, mix=self.mix, merge_every=self.merge_every, seed=self.seed)
+
+    def emails(self):
+        return ['author%d@example.com' % i for i in range(self.n_authors)]
+
+    def build(self, path):
+        rng = random.Random(self.seed)
+        repo = git.init_repository(path, bare=True)
+        kinds = sorted(self.mix)
+        # files (and their content) of the tree
+        words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for i in range(rng.randint(1, 10))) for j in range(2000)]
+        lines = []
+        for i in range(1000):
+            line = []
+            while sum(len(word) + 1 for word in line) < rng.randint(0, 2 * self.line_length): line.append(rng.choice(words))
+            lines.append(' '.join(line))
+        files = [] # (folder, name, is_text)
+        for i in range(self.n_files):
+            kind = rng.choices(kinds, [self.mix[kind] for kind in kinds])[0]
+            files.append(('dir%d' % (i % 8), 'file%d%s' % (i, rng.choice(FILEEXT_MIX[kind])), kind in ('text', 'code', 'data')))
+        contents = [[] for i in range(self.n_files)] # lines of the text files
+        diaries = [[] for i in range(self.n_authors)]
+        folders = dict() # folder -> dict(name -> blob id)
+        trees = dict() # folder -> tree id
+        def write_tree(changed):
+            for folder in changed:
+                builder = repo.TreeBuilder()
+                for name, blob_id in folders[folder].items():
+                    builder.insert(name, blob_id, git.GIT_FILEMODE_BLOB)
+                trees[folder] = builder.write()
+            builder = repo.TreeBuilder()
+            for folder, tree_id in trees.items():
+                builder.insert(folder, tree_id, git.GIT_FILEMODE_TREE)
+            return builder.write()
+        # commits
+        emails = self.emails()
+        parents, history = [], []
+        for i in range(self.n_commits):
+            t = int((SYNTHETIC_START + timedelta(hours=i)).timestamp())
+            iauthor = rng.randrange(self.n_authors)
+            signature = git.Signature('Author %d' % iauthor, emails[iauthor], t, 0)
+            if i > 0 and i % self.merge_every == 0: # merge an older commit, same tree
+                merged = history[rng.randrange(max(0, len(history) - self.merge_every), len(history) - 1)] if len(history) > 1 else parents[0]
+                commit_id = repo.create_commit(None, signature, signature, 'Merge %d' % i, repo[parents[0]].tree_id, parents + [merged])
+            else:
+                changed = set()
+                if rng.random() < 0.05: # diary
+                    date = (SYNTHETIC_START + timedelta(hours=i)).date()
+                    diaries[iauthor].append('# %s\n\n%s\n' % (date.isoformat(), rng.choice(lines)))
+                    folders.setdefault('Diary', dict())['author%d.md' % iauthor] = repo.create_blob('\n'.join(diaries[iauthor]).encode())
+                    changed.add('Diary')
+                for ifile in rng.sample(range(self.n_files), min(self.n_files, rng.randint(1, 3))):
+                    folder, name, is_text = files[ifile]
+                    if is_text:
+                        content = contents[ifile]
+                        for j in range(rng.randint(1, 4)): # insert, delete or replace some lines
+                            k = rng.randint(0, len(content))
+                            op = rng.random()
+                            if len(content) > self.max_lines: del content[k:k + rng.randint(5, 20)]
+                            elif op < 0.6 or len(content) == 0: content[k:k] = rng.sample(lines, rng.randint(1, 10))
+                            elif op < 0.8: del content[k:k + rng.randint(1, 5)]
+                            else: content[k:k + 1] = [rng.choice(lines)]
+                        data = ('\n'.join(content) + '\n').encode()
+                    else:
+                        n = rng.randint(100, 4000)
+                        data = rng.getrandbits(8 * n).to_bytes(n, 'little')
+                    folders.setdefault(folder, dict())[name] = repo.create_blob(data)
+                    changed.add(folder)
+                commit_id = repo.create_commit(None, signature, signature, 'Commit %d' % i, write_tree(changed), parents)
+            parents = [commit_id]
+            history.append(commit_id)
+        repo.references.create('refs/heads/master', parents[0], force=True)
+        return repo
+
+def synthetic_config(synthetic, html, n_queries=10):
+    '''Config of "durations" for a synthetic repository, with queries of the same length'''
+    hours = synthetic.n_commits / n_queries
+    return {
+        'title': 'Benchmark', 'subtitle': '%d commits' % synthetic.n_commits, 'note': '', 'export': 'benchmark', 'html': html,
+        'query type': 'durations',
+        'queries': [{'name': 'Q%d' % i,
+            'since': (SYNTHETIC_START + timedelta(hours=hours * i - 1)).isoformat(),
+            'until': (SYNTHETIC_START + timedelta(hours=hours * (i + 1))).isoformat()} for i in range(n_queries)],
+        'authors': [{'name': 'Author %d' % i, 'emails': [email], 'labels': ['bench'], 'diary': ['Diary/author%d.md' % i]}
+            for i, email in enumerate(synthetic.emails())],
+    }
+
+def bench_synthetic(synthetic, workdir, n_queries=10, max_patch_commits=1000):
+    '''Time the phases of gitstat on a synthetic repository (built in workdir if not yet)
+
+    Returns:
+        result (dict): params, seconds to build, timers and counters (see gitstat.Metrics)
+    '''
+    metrics = gitstat.metrics
+    path = os.path.join(workdir, 'synthetic_%d_%d_%d_%d_%d_%d_%s.git' % (synthetic.n_commits, synthetic.n_authors,
+        synthetic.n_files, synthetic.line_length, synthetic.max_lines, synthetic.seed, '_'.join('%s%g' % item for item in sorted(synthetic.mix.items()))))
+    t_build = None
+    if not os.path.exists(path):
+        print('Build %s ...' % (path), end='', flush=True)
+        t = time.perf_counter()
+        synthetic.build(path + '.tmp')
+        os.rename(path + '.tmp', path)
+        t_build = time.perf_counter() - t
+        print('%.1f s' % (t_build))
+    repo = git.Repository(path)
+    config = synthetic_config(synthetic, os.path.join(workdir, 'html', 'index_%d.html' % synthetic.n_commits), n_queries)
+    durations = gitstat.get_durations(config)
+    fake_commits = set()
+    metrics.clear()
+    # walk and filter
+    with metrics.timer('walk'):
+        commits = list(gitstat.walk_commits(repo, gitstat.get_target(repo)))
+    with metrics.timer('filter'):
+        for info in config['authors']:
+            for since, until in durations:
+                commit_filter = gitstat._make_commit_filter(set(info['emails']), since, until, set(), fake_commits)
+                metrics.count('commits filtered', sum(1 for commit in commits if commit_filter(commit)))
+    # statistics of all the authors and queries, by Author.generate_stats() and by dispatch_stats()
+    authors = [gitstat.Author(info, repo) for info in config['authors']]
+    cache = gitstat.CommitStatsCache(maxsize=len(commits))
+    with metrics.timer('generate_stats'):
+        for author in authors:
+            for iquery, (since, until) in enumerate(durations):
+                author.generate_stats(repo, commits, since, until, fake_commits, iquery, cache=cache)
+    with metrics.timer('index'):
+        index = gitstat.CommitIndex(commits)
+    authors = [gitstat.Author(info, repo) for info in config['authors']]
+    gitstat.dispatch_stats(repo, authors, index, durations, fake_commits) # new cache, diff again
+    # parse the patches of the latest commits
+    patches = [(patch.delta.new_file.path, patch.delta.status, patch.hunks) for commit in commits[:max_patch_commits]
+        if len(commit.parent_ids) == 1 for patch in repo.diff(commit.parents[0], commit)]
+    with metrics.timer('parse_append'):
+        for filepath, status, hunks in patches:
+            gitstat.FileStat(filepath).parse_append(0, hunks, status)
+    # summaries, diaries and html
+    with metrics.timer('summaries'):
+        for author in authors:
+            author.summarize(len(durations))
+        gitstat.summary_matrix(authors, len(durations))
+    gitstat._diary_dates.clear() # parse again
+    tree = repo[gitstat.get_target(repo)].tree
+    with metrics.timer('check_diary'):
+        for author in authors:
+            author.check_diary(None, durations, check_file=True, check_content=True, tree=tree)
+    with metrics.timer('html'):
+        report.write_durations(config, authors)
+    result = dict(params=synthetic.params(), n_queries=n_queries, build_seconds=t_build, **metrics.to_dict())
+    return result
+
+def print_comparison(results, baseline):
+    '''Print the ratios of the timers to a baseline (json of bench_synthetic())'''
+    for n_commits, result in results.items():
+        if n_commits not in baseline['results']:
+            continue
+        print('%s commits (current / baseline):' % (n_commits))
+        base_timers = baseline['results'][n_commits]['timers']
+        for name, timer in result['timers'].items():
+            if name in base_timers and base_timers[name]['seconds'] > 0:
+                print('  %-16s %8.3f s %8.3f s %6.2fx' % (name, timer['seconds'], base_timers[name]['seconds'],
+                    timer['seconds'] / base_timers[name]['seconds']))
+
+def _time(engine, patches):
+    t = time.perf_counter()
+    for patch in patches:
+        engine(patch)
+    return time.perf_counter() - t
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of gitstat')
+    subparsers = parser.add_subparsers(dest='command')
+    parser_wordcount = subparsers.add_parser('wordcount', help='compare word counting with the regex on a repository')
+    parser_wordcount.add_argument('repository', help='path of the repository')
+    parser_wordcount.add_argument('--max-commits', type=int, default=1000, help='number of latest commits to diff')
+    parser_profiles = subparsers.add_parser('profiles', help='compare the stats of the diff profiles on a repository')
+    parser_profiles.add_argument('repository', nargs='?', help='path of the repository (edits around blank lines if not given)')
+    parser_profiles.add_argument('--max-commits', type=int, default=1000, help='number of latest commits to diff')
+    parser_diary = subparsers.add_parser('diary', help='compare parsing of diaries with dateutil')
+    parser_diary.add_argument('diaries', nargs='+', help='paths of the diaries')
+    parser_synthetic = subparsers.add_parser('synthetic', help='time the phases on synthetic repositories')
+    parser_synthetic.add_argument('--scales', default='1000,10000,100000', help='numbers of commits, separated by comma')
+    parser_synthetic.add_argument('--authors', type=int, default=10, help='number of authors')
+    parser_synthetic.add_argument('--files', type=int, default=50, help='number of files')
+    parser_synthetic.add_argument('--line-length', type=int, default=60, help='mean number of characters of a line')
+    parser_synthetic.add_argument('--max-lines', type=int, default=300, help='maximum number of lines of a text file')
+    parser_synthetic.add_argument('--mix', default=','.join('%s=%g' % item for item in sorted(DEFAULT_MIX.items())),
+        help='weights of the kinds of files (%s)' % ', '.join(sorted(FILEEXT_MIX)))
+    parser_synthetic.add_argument('--queries', type=int, default=10, help='number of queries')
+    parser_synthetic.add_argument('--seed', type=int, default=0)
+    parser_synthetic.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'gitstat_benchmark'),
+        help='folder of the synthetic repositories (kept for the next runs)')
+    parser_synthetic.add_argument('--output', help='json file to write the results')
+    parser_synthetic.add_argument('--baseline', help='json file of previous results to compare with')
+    args = parser.parse_args()
+
+    if args.command == 'wordcount':
+        ret = bench_wordcount(git.Repository(args.repository), args.max_commits)
+        sys.exit(0 if ret else 1)
+    elif args.command == 'profiles':
+        if args.repository is None:
+            with tempfile.TemporaryDirectory() as path:
+                ret = bench_profiles(blank_lines_repo(path), args.max_commits)
+        else:
+            ret = bench_profiles(git.Repository(args.repository), args.max_commits)
+        sys.exit(0 if ret else 1)
+    elif args.command == 'diary':
+        ret = bench_diary(args.diaries)
+        sys.exit(0 if ret else 1)
+    elif args.command == 'synthetic':
+        mix = dict((kind, float(weight)) for kind, weight in (item.split('=') for item in args.mix.split(',')))
+        assert all(kind in FILEEXT_MIX for kind in mix), 'Unknown kind of files in --mix'
+        results = dict()
+        for n_commits in (int(n) for n in args.scales.split(',')):
+            synthetic = SyntheticRepo(n_commits, args.authors, args.files, args.line_length, args.max_lines, mix, seed=args.seed)
+            result = results[str(n_commits)] = bench_synthetic(synthetic, args.workdir, args.queries)
+            print('%d commits:' % (n_commits))
+            for name, timer in result['timers'].items():
+                print('  %-16s %8.3f s (%d calls)' % (name, timer['seconds'], timer['calls']))
+        output = dict(python=platform.python_version(), pygit2=git.__version__, numpy=gitstat.np is not None,
+            date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), results=results)
+        if args.output is not None:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(output, f, indent=1)
+        if args.baseline is not None:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                print_comparison(results, json.load(f))
+    else:
+        parser.print_help()
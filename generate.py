@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+import gitstat
+import report
+import sys, argparse, cProfile
+from datetime import datetime
+
+def generate(config, repo, commits, cache=None, jobs=1, authors=None):
+    '''Generate statistics of all the reports of the config (see gitstat.generate_reports())
+
+    Returns:
+        authors (list(gitstat.Author)): Stats of all the queries (to append newer commits later)
+        reports (list(tuple)): (query type, config of the report, authors of the report) of each report
+    '''
+    return gitstat.generate_reports(config, repo, commits, cache=cache, jobs=jobs, authors=authors)
+
+def write_html(reports):
+    '''Write the html (and exports) of the reports'''
+    report.write_reports(reports)
+
+def main(query_type=None, description='Generate statistics of total and durations'):
+    '''Run a config from the command line (query_type is the expected "query type", None for any)'''
+    print(sys.argv[0], 'at', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('config', help='json file of configurations')
+    parser.add_argument('--jobs', type=int, default=1, help='number of processes to diff commits')
+    parser.add_argument('--metrics', help='json file to write the timers and counters of the run')
+    parser.add_argument('--profile', help='file to write the cProfile stats of the run')
+    args = parser.parse_args()
+    started = datetime.now()
+    if args.profile is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # load configurations
+    config = gitstat.load_config(args.config, query_type)
+    callbacks = gitstat.get_callbacks(config)
+    # get repo (clone if needed) and update
+    repo = gitstat.open_repository(config, callbacks)
+    with gitstat.metrics.timer('update'):
+        gitstat.update(repo, callbacks=callbacks) # fetch only if bare
+
+    # generate statistics of all the reports in one pass
+    store = gitstat.open_store(config, repo)
+    commits = gitstat.walk_commits(repo, gitstat.get_target(repo), since=gitstat.get_since(config)) # stop at the earliest query
+    cache = gitstat.CommitStatsCache(store=store, diff_filter=gitstat.get_diff_filter(config))
+    authors, reports = generate(config, repo, commits, cache=cache, jobs=args.jobs)
+    with gitstat.metrics.timer('store'): store.close()
+
+    # generate html
+    with gitstat.metrics.timer('html'): write_html(reports)
+
+    # metrics of the run
+    if args.profile is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile) # python -m pstats FILE
+    if args.metrics is not None:
+        gitstat.metrics.write(args.metrics, script=sys.argv[0], config=args.config, jobs=args.jobs,
+            started=started.strftime('%Y-%m-%d %H:%M:%S'), seconds=(datetime.now() - started).total_seconds())
+
+if __name__ == '__main__':
+    main()
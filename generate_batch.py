@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+import gitstat
+import generate
+import pygit2 as git
+import sys, os, argparse, multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+def collect_configs(paths):
+    '''Paths of the json files (all *.json in the folders)'''
+    configs = []
+    for path in paths:
+        if os.path.isdir(path):
+            configs += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.json'))
+        else:
+            configs.append(path)
+    return configs
+
+def group_configs(configs):
+    '''Group the configs by repository
+
+    Returns:
+        groups (OrderedDict): absolute path of repository -> list(tuple(str, dict)) of (path, config)
+    '''
+    groups = OrderedDict()
+    for path, config in configs:
+        groups.setdefault(os.path.abspath(config['repository']), []).append((path, config))
+    return groups
+
+def run_repository(repo_dir, configs):
+    '''Generate statistics and html of all the configs of a repository
+
+    The repository, the walk (CommitIndex) and the stats of commits (cache and
+    store) are shared by all the configs (one cache for each diff filter).
+    A config which fails is printed and skipped, the others are still done
+    (errors of the repository itself are raised).
+
+    Returns:
+        repo_dir (str):
+        n (int): Number of configs done
+        errors (list(tuple(str, str))): (path, error) of the configs which failed
+    '''
+    repo = git.Repository(repo_dir)
+    store = gitstat.open_store(configs[0][1], repo)
+    try:
+        caches = {} # key of DiffFilter -> CommitStatsCache
+        since = min(gitstat.get_since(config) for path, config in configs)
+        with gitstat.metrics.timer('walk'):
+            index = gitstat.CommitIndex(gitstat.walk_commits(repo, gitstat.get_target(repo), since=since)) # stop at the earliest query
+        errors = []
+        for path, config in configs:
+            print('Config:', path)
+            try:
+                diff_filter = gitstat.get_diff_filter(config)
+                if diff_filter.key not in caches: caches[diff_filter.key] = gitstat.CommitStatsCache(store=store, diff_filter=diff_filter)
+                authors, reports = generate.generate(config, repo, index, cache=caches[diff_filter.key])
+                with gitstat.metrics.timer('html'): generate.write_html(reports)
+            except Exception as e: # e.g. wrong config, html not writable
+                print('Error in %s: %r' % (path, e))
+                errors.append((path, repr(e)))
+    finally:
+        with gitstat.metrics.timer('store'): store.close() # stats of the configs done are kept
+    return repo_dir, len(configs) - len(errors), errors
+
+def _run_repository_process(repo_dir, configs):
+    '''run_repository() in a process of the pool, returning its metrics as well'''
+    gitstat.metrics.clear()
+    return run_repository(repo_dir, configs) + (gitstat.metrics.to_dict(),)
+
+if __name__ == '__main__':
+    print(sys.argv[0], 'at', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+    parser = argparse.ArgumentParser(description='Generate statistics for many config files')
+    parser.add_argument('configs', nargs='+', help='json files of configurations, or folders of them')
+    parser.add_argument('--jobs', type=int, default=1, help='number of repositories processed at the same time')
+    parser.add_argument('--fetch-jobs', type=int, default=4, help='number of repositories pulled at the same time')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds for pulling a repository')
+    parser.add_argument('--retries', type=int, default=2, help='number of retries if pulling failed')
+    parser.add_argument('--metrics', help='json file to write the timers and counters of the run')
+    args = parser.parse_args()
+    started = datetime.now()
+
+    # load configurations (a config or a repository which fails is skipped, and the exit status is 1)
+    configs, failed = [], []
+    for path in collect_configs(args.configs):
+        try:
+            config = gitstat.load_config(path)
+            assert config['query type'] in gitstat.QUERY_TYPES, 'Wrong query type in %s' % (path)
+            configs.append((path, config))
+        except Exception as e:
+            print('Error in %s: %r' % (path, e))
+            failed.append(path)
+    groups = group_configs(configs)
+    print('Number of configs: %d, repositories: %d' % (len(configs), len(groups)))
+
+    # credentials (may be asked here) and clone if needed
+    tasks = []
+    for repo_dir, group in groups.items():
+        try:
+            config = group[0][1]
+            callbacks = gitstat.get_callbacks(config)
+            gitstat.open_repository(config, callbacks)
+            tasks.append((repo_dir, repo_dir, callbacks))
+        except Exception as e:
+            print('Error in %s: %r' % (repo_dir, e))
+            failed += [path for path, config in group]
+
+    # pull repositories concurrently, and generate statistics and html of each one as soon as it is pulled
+    pulled = gitstat.pull_all(tasks, max_workers=args.fetch_jobs, timeout=args.timeout, retries=args.retries)
+    if args.jobs > 1:
+        with ProcessPoolExecutor(args.jobs, mp_context=multiprocessing.get_context('spawn')) as pool: # no fork with threads
+            futures = []
+            futures = dict()
+            for repo_dir, ret, error in pulled:
+                if not ret: print('Use the local repository:', repo_dir)
+                futures[pool.submit(_run_repository_process, repo_dir, groups[repo_dir])] = repo_dir
+            for future in as_completed(futures):
+                try:
+                    repo_dir, n, errors, metrics = future.result()
+                except Exception as e: # the other repositories go on
+                    print('Error in %s: %r' % (futures[future], e))
+                    failed += [path for path, config in groups[futures[future]]]
+                    continue
+                gitstat.metrics.merge(metrics)
+                failed += [path for path, error in errors]
+                print('Done: %s (%d configs)' % (repo_dir, n))
+    else:
+        for repo_dir, ret, error in pulled:
+            if not ret: print('Use the local repository:', repo_dir)
+            try:
+                repo_dir, n, errors = run_repository(repo_dir, groups[repo_dir])
+            except Exception as e: # the other repositories go on
+                print('Error in %s: %r' % (repo_dir, e))
+                failed += [path for path, config in groups[repo_dir]]
+                continue
+            failed += [path for path, error in errors]
+            print('Done: %s (%d configs)' % (repo_dir, n))
+
+    # metrics of the run
+    if args.metrics is not None:
+        gitstat.metrics.write(args.metrics, script=sys.argv[0], configs=[path for path, config in configs], jobs=args.jobs,
+            started=started.strftime('%Y-%m-%d %H:%M:%S'), seconds=(datetime.now() - started).total_seconds())
+
+    if len(failed) > 0:
+        print('Failed configs (%d):' % (len(failed)), ', '.join(failed))
+        sys.exit(1)
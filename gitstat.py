@@ -3,9 +3,26 @@
 
 import os
 import re # regular expression
+import fnmatch
+import copy
+import io
+import json
+import getpass
+import time
+import contextlib
+import sqlite3
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from array import array
 import pygit2 as git
-from datetime import datetime, timezone, timedelta
-import dateutil.parser
+from datetime import datetime, timedelta
+import dateutil, dateutil.parser
+try:
+    import numpy as np # optional, for faster summaries
+except ImportError:
+    np = None
 
 # definition of file extensions (use set)
 # ambiguous: 'ipynb', '.tex', '.bib', '.htm', '.html', ''
@@ -19,14 +36,101 @@ FILEEXT_FIGURE_BITMAP_LOSSY = {'.jpg', '.jpeg', '.bmp'}
 
 # definition of a word
 PATTERN_WORD = re.compile('(\S+)')
+# same definition for utf-8 bytes (see count_words())
+WORD_MARKS = bytes(0 if chr(i).isspace() else 1 for i in range(128)) + bytes([1] * 128) # whitespace -> 0, others -> 1
+WORD_MARKS_LINES = WORD_MARKS[:10] + b'\n' + WORD_MARKS[11:] # keep linebreaks to split lines
+PATTERN_UNICODE_SPACE = re.compile(b'\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80')
+
+# dates in headings of diaries (see parse_date()), other headings are parsed by dateutil
+_MONTHS = dict((name.lower(), i + 1) for i, names in enumerate(dateutil.parser.parserinfo.MONTHS) for name in names)
+_PATTERN_MONTH = '(?:%s)' % '|'.join(sorted(_MONTHS, key=len, reverse=True))
+_PATTERN_WORDS = r'[^\W\d_]+(?:[ \t]+[^\W\d_]+)*' # letters only
+PATTERN_DATE_HEADING = re.compile(
+    r'#+[ \t]*(?:(?P<pre>%s)(?:[ \t]+|[ \t]*[:,-][ \t]*))?(?:' % (_PATTERN_WORDS) +
+    r'(?P<y1>\d{4})(?P<s1>[-/.])(?P<m1>\d{1,2})(?P=s1)(?P<d1>\d{1,2})|' # 2017-09-08, 2017/9/8, 2017.09.08
+    r'(?P<a2>\d{1,2})(?P<s2>[-/.])(?P<b2>\d{1,2})(?P=s2)(?P<y2>\d{4})|' # 09/08/2017 (month first), 13/08/2017
+    r'(?P<d3>\d{1,2})(?:st|nd|rd|th)?[ \t]+(?:of[ \t]+)?(?P<m3>%s)\.?,?[ \t]+(?P<y3>\d{4})|' % (_PATTERN_MONTH) + # 8 Sep 2017
+    r'(?P<m4>%s)\.?[ \t]+(?P<d4>\d{1,2})(?:st|nd|rd|th)?,?[ \t]+(?P<y4>\d{4})' % (_PATTERN_MONTH) + # Sep 8, 2017
+    r')(?:(?P<sep>[ \t]+|[ \t]*[:,-][ \t]*)(?P<post>%s))?\s*' % (_PATTERN_WORDS), re.IGNORECASE) # whole heading
+_WEEKDAYS = [name.lower() for names in dateutil.parser.parserinfo.WEEKDAYS for name in names]
+PATTERN_DATE_TOKEN = re.compile(r'\d|(?<![^\W\d_])(?:%s|%s)(?![^\W\d_])' % (_PATTERN_MONTH, '|'.join(_WEEKDAYS)), re.IGNORECASE) # no date without them
+_DATE_WORDS = set(word.lower() for word in # words used by dateutil (e.g. am, pm, of, month)
+    dateutil.parser.parserinfo.JUMP + dateutil.parser.parserinfo.UTCZONE + dateutil.parser.parserinfo.PERTAIN +
+    [word for words in dateutil.parser.parserinfo.MONTHS + dateutil.parser.parserinfo.HMS + dateutil.parser.parserinfo.AMPM for word in words])
 
 # definition of scores
 EQUIVWORDS_FIGURE_VECTOR = 100
 EQUIVWORDS_FIGURE_BITMAP_LOSSLESS = 50
 EQUIVWORDS_FIGURE_BITMAP_LOSSY = 25
 EQUIVWORDS_BIB_MAX = 50 # upper bound every time
+# options of repo.diff() (only + and - lines are counted, so the lean profile gives the same stats as the default
+# options with fewer lines; the whitespace profile ignores blank lines and lines with only whitespace changed, and
+# libgit2 then also drops some lines with words next to them, so its stats are different)
+DIFF_PROFILES = {
+    'legacy': dict(flags=0, context_lines=3, interhunk_lines=0), # default of repo.diff()
+    'lean': dict(flags=0, context_lines=0, interhunk_lines=0),
+    'whitespace': dict(flags=git.GIT_DIFF_IGNORE_BLANK_LINES | git.GIT_DIFF_IGNORE_WHITESPACE_CHANGE, context_lines=0, interhunk_lines=0),
+}
+DIFF_PROFILE = 'lean'
+RENAME_LIMIT = 1000 # pairs of candidates (sources x targets) for the similarity of renames, exact renames only if more
+RENAME_THRESHOLD = 50 # similarity (%) of renames and copies
+RENAME_MAX_SIZE = 1 << 20 # bytes, exact renames only if a candidate is larger
+STORE_SCHEMA = 2 # user_version of StatsStore (1: oldpath of filestats, 2: version of diaries)
+DIARY_VERSION = 1 # increase it when the results of parse_diary() change (invalidate the dates in StatsStore)
+SCORING_VERSION = 2 # increase it when the results of diff_commit() change (invalidate StatsStore; 2: blank lines not ignored by lean)
+
+class Metrics:
+    '''Timers and counters of the phases of a run
+
+    Example:
+        with metrics.timer('diff'):
+            ...
+        metrics.count('patches generated')
+        metrics.write('metrics.json', script='generate_total.py')
+    '''
+    def __init__(self):
+        self.timers = OrderedDict() # name -> [seconds, calls]
+        self.counters = OrderedDict() # name -> int
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            timer = self.timers.setdefault(name, [0.0, 0])
+            timer[0] += time.perf_counter() - t
+            timer[1] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def clear(self):
+        self.timers.clear()
+        self.counters.clear()
 
-def clone(url, path, callbacks=None):
+    def merge(self, other):
+        '''Add the metrics of other (a Metrics.to_dict(), e.g. from another process)'''
+        for name, timer in other['timers'].items():
+            merged = self.timers.setdefault(name, [0.0, 0])
+            merged[0] += timer['seconds']
+            merged[1] += timer['calls']
+        for name, n in other['counters'].items():
+            self.count(name, n)
+
+    def to_dict(self):
+        return {
+            'timers': OrderedDict((name, {'seconds': seconds, 'calls': calls}) for name, (seconds, calls) in self.timers.items()),
+            'counters': OrderedDict(self.counters)}
+
+    def write(self, path, **info):
+        '''Write the metrics (and info of the run) to a json file'''
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(OrderedDict(info, **self.to_dict()), f, indent=1)
+
+metrics = Metrics() # metrics of this process
+
+def clone(url, path, callbacks=None, bare=False):
     '''Clone from the repository.
 
     Example:
@@ -36,13 +140,14 @@ def clone(url, path, callbacks=None):
         url (str): URL of the repository
         path (str): Local path to clone into
         callbacks (pygit2.RemoteCallbacks): Callback for credentials
+        bare (bool): Clone without working tree (see fetch())
 
     Returns:
         ret (bool): True for success, False otherwise.
     '''
     if not os.path.exists(path):
         print('Clone from %s to %s ...' % (url, path), end='')
-        repo = git.clone_repository(url, path, callbacks=callbacks)
+        repo = git.clone_repository(url, path, bare=bare, callbacks=callbacks)
         if repo is None:    print('failed.');   return False
         else:               print('done.');     return True
     else:
@@ -98,17 +203,202 @@ def pull(repo, remote_name='origin', branch='master', callbacks=None):
             else:
                 raise AssertionError('Unknown merge analysis result')
     else:
-        printf('failed')
+        print('failed')
+        return False
+
+def fetch(repo, remote_name='origin', callbacks=None):
+    '''Fetch from the repository (for bare repositories)
+
+    Only the remote-tracking refs (refs/remotes/origin/...) are updated, nothing
+    is merged or checked out. Use get_target() to find the commit to analyze.
+
+    Example:
+        ret = fetch(repo, callbacks=callbacks)
+
+    Args:
+        repo (pygit2.Repository): Repository object
+        remote_name (str): Remote name
+        callbacks (pygit2.RemoteCallbacks): Callback for credentials
+
+    Returns:
+        ret (bool): True for success, False otherwise.
+    '''
+    print('Fetch to %s ...' % (repo.path), end='')
+    for remote in repo.remotes:
+        if remote.name == remote_name:
+            remote.fetch(callbacks=callbacks)
+            print('done')
+            return True
+    else:
+        print('failed')
         return False
 
+def update(repo, remote_name='origin', branch='master', callbacks=None):
+    '''Fetch if the repository is bare, pull otherwise'''
+    if repo.is_bare:
+        return fetch(repo, remote_name, callbacks=callbacks)
+    return pull(repo, remote_name, branch, callbacks=callbacks)
+
+def get_target(repo, remote_name='origin', branch='master'):
+    '''Commit id to analyze
+
+    The fetched branch (refs/remotes/<remote_name>/<branch>) for bare repositories,
+    falling back to the local branch and HEAD. HEAD for the others (updated by pull()).
+    '''
+    if repo.is_bare:
+        for name in ('refs/remotes/%s/%s' % (remote_name, branch), 'refs/heads/%s' % (branch)):
+            ref = repo.references.get(name)
+            if ref is not None:
+                return ref.resolve().target
+    return repo.head.target
+
+class _DeadlineCallbacks(git.RemoteCallbacks):
+    '''Callbacks (with the credentials of callbacks) which cancel the transfer after the deadline'''
+    def __init__(self, callbacks, deadline):
+        git.RemoteCallbacks.__init__(self)
+        if callbacks is not None:
+            self.credentials = callbacks.credentials
+            self.certificate_check = callbacks.certificate_check
+        self.deadline = deadline # time.monotonic()
+
+    def sideband_progress(self, string):
+        self._check_deadline()
+
+    def transfer_progress(self, stats):
+        self._check_deadline()
+
+    def _check_deadline(self):
+        if time.monotonic() > self.deadline:
+            raise TimeoutError('Transfer timeout') # cancel the transfer
+
+def pull_all(tasks, max_workers=4, timeout=600, retries=2):
+    '''Pull many repositories concurrently with a bounded thread pool
+
+    libgit2 releases the GIL during network I/O, so fetches of different
+    repositories overlap. Results are yielded as soon as each repository is
+    done, so the next stage can start without waiting for the slowest one.
+
+    The deadline of a try is only checked in the progress callbacks of the
+    transfer, so a connection which stalls without any progress is not
+    cancelled by it; the connect and read timeouts of libgit2 (set to timeout,
+    for all the repositories while pulling) stop those instead. An error which
+    is not from the network (e.g. KeyError for a missing branch, AssertionError
+    for merge conflicts) is not retried, and is yielded like the others.
+
+    Example:
+        for key, ret, error in pull_all([(key, repo_path, callbacks), ...]):
+            ...
+
+    Args:
+        tasks (list(tuple)): (key, path of repository, pygit2.RemoteCallbacks)
+        max_workers (int): Number of threads
+        timeout (float): Seconds for each try, the transfer is cancelled after it (also the socket timeouts)
+        retries (int): Number of retries after a failed try
+
+    Returns:
+        results (generator(tuple)): (key, ret, error) in order of completion, ret is the result of update()
+    '''
+    def run(path, callbacks):
+        for i in range(retries + 1):
+            try:
+                repo = git.Repository(path) # one object for each thread
+                return update(repo, callbacks=_DeadlineCallbacks(callbacks, time.monotonic() + timeout)), None
+            except (git.GitError, OSError) as e: # OSError includes TimeoutError
+                error = e
+                print('Failed to pull %s (try %d/%d): %s' % (path, i + 1, retries + 1, e))
+            except Exception as e: # not worth retrying, but the other repositories go on
+                print('Failed to pull %s: %r' % (path, e))
+                return False, e
+        return False, error
+    settings = [name for name in ('server_connect_timeout', 'server_timeout') if hasattr(git.settings, name)] # libgit2 >= 1.7
+    saved = [getattr(git.settings, name) for name in settings]
+    for name in settings: setattr(git.settings, name, int(timeout * 1000)) # milliseconds
+    try:
+        with ThreadPoolExecutor(max_workers) as pool:
+            futures = dict((pool.submit(run, path, callbacks), key) for key, path, callbacks in tasks)
+            for future in as_completed(futures):
+                ret, error = future.result()
+                yield futures[future], ret, error
+    finally:
+        for name, value in zip(settings, saved): setattr(git.settings, name, value)
+
+CONFIG_REQUIRED = ('title', 'subtitle', 'note', 'url', 'clone', 'repository', 'html', 'export', 'weights',
+    'query type', 'queries', 'authors') # 'pubkey', 'privkey', 'cache', 'bare', 'include', 'exclude', 'max blob size',
+    # 'diff profile', 'renames', 'copies', 'rename limit', 'rename threshold', 'rename max size',
+    # 'gzip', 'exports', 'html total' (query type mixed), 'fake commits', 'diary', 'his commits' are optional
+
+def load_config(path, query_type=None):
+    '''Load configurations from a json file
+
+    Args:
+        path (str): Path of the json file
+        query_type (str): Expected "query type" ('total', 'durations' or 'mixed'), None for any
+
+    Returns:
+        config (dict):
+    '''
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    assert all(key in config for key in CONFIG_REQUIRED), 'Some settings in config file are missing.'
+    if query_type is not None:
+        assert config['query type'] == query_type, 'Wrong query type'
+    return config
+
+def get_callbacks(config):
+    '''Create callbacks with credentials for the remote
+
+    Use ssh key if "pubkey" and "privkey" are set, otherwise ask for username and password.
+    '''
+    credentials = None
+    if 'pubkey' in config and 'privkey' in config:
+        if os.path.exists(config['pubkey']) and os.path.exists(config['privkey']):
+            username = 'git'
+            pubkey = config['pubkey']
+            privkey = config['privkey']
+            passphrase = ''
+            credentials = git.Keypair(username, pubkey, privkey, passphrase)
+        else:
+            print('File for pubkey or privkey does not exist')
+    if credentials is None: # use username & password
+        username = input('Please input your user name: ')
+        password = getpass.getpass('Please input your password: ')
+        credentials = git.UserPass(username, password)
+        # pygit2 for windows could only use UserPass? cannot use SSH? (allowed = 1)
+    return git.RemoteCallbacks(credentials=credentials)
+
+def open_repository(config, callbacks=None):
+    '''Open the repository of the config (clone if needed, without working tree if "bare" is true)'''
+    if not os.path.exists(config['repository']):
+        clone(config['clone'], config['repository'], callbacks=callbacks, bare=config.get('bare', False))
+    return git.Repository(config['repository'])
+
+def open_store(config, repo):
+    '''Open the StatsStore of the config ("cache", or gitstat.sqlite in the .git folder by default)'''
+    return StatsStore(config['cache'] if 'cache' in config else os.path.join(repo.path, 'gitstat.sqlite'))
+
+def get_diff_filter(config):
+    '''DiffFilter of the config ("include", "exclude", "max blob size", "diff profile" and the options of renames)'''
+    return DiffFilter(config.get('include', ()), config.get('exclude', ()), config.get('max blob size'), config.get('diff profile', DIFF_PROFILE),
+        renames=config.get('renames', False), copies=config.get('copies', False), rename_limit=config.get('rename limit', RENAME_LIMIT),
+        rename_threshold=config.get('rename threshold', RENAME_THRESHOLD), rename_max_size=config.get('rename max size', RENAME_MAX_SIZE))
+
+def get_durations(config):
+    '''(since, until) of each query in the config'''
+    return [(dateutil.parser.isoparse(query['since']), dateutil.parser.isoparse(query['until'])) for query in config['queries']]
+
+def get_fake_commits(config, repo):
+    '''Ids of the fake commits in the config'''
+    return set(repo[rev].id for rev in config['fake commits'] if rev in repo) if 'fake commits' in config else set()
+
 class Stat:
+    __slots__ = ('iquery', 'lines_inserted', 'lines_deleted', 'words_inserted', 'words_deleted')
+
     def __init__(self, iquery, lines_inserted, lines_deleted, words_inserted, words_deleted):
         self.iquery = iquery # by which query
         self.lines_inserted = lines_inserted
         self.lines_deleted = lines_deleted
         self.words_inserted = words_inserted
         self.words_deleted = words_deleted
-        # TODO: with a set of commit_id, it is possible to compute n_commits for each file
 
     def __add__(self, r): # for sum()
         return Stat(-1,
@@ -128,58 +418,832 @@ class Stat:
         self.words_deleted += r.words_deleted
         return self
 
+def _get_criteria(fileext):
+    '''Criteria for scoring according to the file extension (lower case)'''
+    if fileext in FILEEXT_TEXT:                         return 0
+    elif fileext in FILEEXT_CODE:                       return 1
+    elif fileext in FILEEXT_FIGURE_VECTOR:              return 10
+    elif fileext in FILEEXT_FIGURE_BITMAP_LOSSLESS:     return 11
+    elif fileext in FILEEXT_FIGURE_BITMAP_LOSSY:        return 12
+    else:                                               return -1
+
+def count_words(data):
+    '''Count words (PATTERN_WORD in the utf-8 text) in bytes without creating the words
+
+    Whitespace is marked as 0 and other bytes as 1 by bytes.translate(), so the
+    number of words is the number of 01 (plus a leading 1).
+    '''
+    if not data.isascii(): data = PATTERN_UNICODE_SPACE.sub(b' ', data) # non-ascii whitespace
+    marks = data.translate(WORD_MARKS)
+    return marks.count(b'\x00\x01') + marks.startswith(b'\x01')
+
+def _count_hunks(patch_hunks):
+    '''Count lines and words inserted / deleted in the hunks of a patch
+
+    Returns:
+        counts (tuple(int)): (lines_inserted, lines_deleted, words_inserted, words_deleted)
+    '''
+    lines_inserted, lines_deleted, words_inserted, words_deleted = 0, 0, 0, 0
+    for hunk in patch_hunks:
+        for line in hunk.lines:
+            if line.origin != '+' and line.origin != '-': continue
+            words_diff = count_words(line.raw_content)
+            if words_diff == 0:         continue # exclude empty line, whitespace change, single linebreak
+            if line.origin == '+':      lines_inserted += 1; words_inserted += words_diff
+            else:                       lines_deleted += 1;  words_deleted += words_diff
+    return lines_inserted, lines_deleted, words_inserted, words_deleted
+
+def _count_patch(data):
+    '''Same as _count_hunks(), but from the text of the patch (patch.data) in one pass
+
+    Lines and their marks (see count_words()) are split together, and only
+    lines starting with + or - in the hunks are counted.
+    '''
+    lines_inserted, lines_deleted, words_inserted, words_deleted = 0, 0, 0, 0
+    start = data.find(b'\n@@') # skip the header (diff --git, index, ---, +++)
+    if start < 0: return lines_inserted, lines_deleted, words_inserted, words_deleted # no hunk (e.g. binary)
+    data = data[start + 1:]
+    marks = (PATTERN_UNICODE_SPACE.sub(b' ', data) if not data.isascii() else data).translate(WORD_MARKS_LINES)
+    for line, mark in zip(data.split(b'\n'), marks.split(b'\n')):
+        origin = line[:1]
+        if origin != b'+' and origin != b'-': continue
+        words_diff = mark.count(b'\x00\x01', 1) + (mark[1:2] == b'\x01') # skip the origin
+        if words_diff == 0:         continue # exclude empty line, whitespace change, single linebreak
+        if origin == b'+':          lines_inserted += 1; words_inserted += words_diff
+        else:                       lines_deleted += 1;  words_deleted += words_diff
+    return lines_inserted, lines_deleted, words_inserted, words_deleted
+
+def _parse_patch(criteria, fileext, patch_status, counts=None):
+    '''Scores of a patch in diff (in one commit)
+
+    Args:
+        criteria (int): from _get_criteria()
+        fileext (str):
+        patch_status (int):
+        counts (tuple(int)): from _count_hunks() or _count_patch(), only needed for text and code (criteria 0, 1)
+
+    Returns:
+        stat (tuple(int)): (lines_inserted, lines_deleted, words_inserted, words_deleted)
+    '''
+    lines_inserted, lines_deleted, words_inserted, words_deleted = 0, 0, 0, 0
+    if criteria == 0 or criteria == 1:
+        lines_inserted, lines_deleted, words_inserted, words_deleted = counts
+        if fileext == '.bib':
+            lines_inserted, lines_deleted, words_deleted = 0, 0, 0
+            if words_inserted > EQUIVWORDS_BIB_MAX: words_inserted = EQUIVWORDS_BIB_MAX
+    elif criteria == 10:
+        words_inserted, words_deleted = (0, EQUIVWORDS_FIGURE_VECTOR) if patch_status == 2 else (EQUIVWORDS_FIGURE_VECTOR, 0) # deleeted; added or modified
+    elif criteria == 11:
+        words_inserted, words_deleted = (0, EQUIVWORDS_FIGURE_BITMAP_LOSSLESS) if patch_status == 2 else (EQUIVWORDS_FIGURE_BITMAP_LOSSLESS, 0) # deleeted; added or modified
+    elif criteria == 12:
+        words_inserted, words_deleted = (0, EQUIVWORDS_FIGURE_BITMAP_LOSSY) if patch_status == 2 else (EQUIVWORDS_FIGURE_BITMAP_LOSSY, 0) # deleeted; added or modified
+    return lines_inserted, lines_deleted, words_inserted, words_deleted
+
+class StatColumns:
+    '''Stats of the files (of an author) in parallel arrays
+
+    One entry for each file in each commit and query, i.e. the columns of
+    Stat with the index of the file and the ordinal of the commit (see
+    FileCommits). Compared with a list of Stat, an entry takes 28 bytes and
+    reductions are loops over plain integers.
+
+    Example:
+        columns = StatColumns()
+        columns.append(ifile, iquery, lines_inserted, lines_deleted, words_inserted, words_deleted, icommit)
+        total, per_query, per_file = columns.aggregate(n_queries, n_files)
+        stats = columns.stats_of(ifile) # from the index of the files, built once and extended with new entries
+    '''
+    COLUMNS = ('ifile', 'iquery', 'lines_inserted', 'lines_deleted', 'words_inserted', 'words_deleted', 'icommit')
+    __slots__ = COLUMNS + ('by_file', 'n_indexed')
+
+    def __init__(self):
+        for name in self.COLUMNS:
+            setattr(self, name, array('i'))
+        self.by_file = [] # positions of the entries of each file (see entries_of())
+        self.n_indexed = 0 # entries in by_file (the later ones are indexed at the next entries_of())
+
+    def __len__(self):
+        return len(self.ifile)
+
+    def append(self, ifile, iquery, lines_inserted, lines_deleted, words_inserted, words_deleted, icommit=0):
+        self.ifile.append(ifile)
+        self.iquery.append(iquery)
+        self.lines_inserted.append(lines_inserted)
+        self.lines_deleted.append(lines_deleted)
+        self.words_inserted.append(words_inserted)
+        self.words_deleted.append(words_deleted)
+        self.icommit.append(icommit)
+
+    def metrics(self):
+        '''Columns of lines_inserted, lines_deleted, words_inserted, words_deleted'''
+        return self.lines_inserted, self.lines_deleted, self.words_inserted, self.words_deleted
+
+    def aggregate(self, n_queries=None, n_files=None):
+        '''Sum the entries in total, by iquery and by ifile in one shot
+
+        With numpy, each sum is a bincount of a column weighted by the metrics;
+        otherwise all the sums are done in a single loop.
+
+        Returns:
+            total (list(int)): [lines_inserted, lines_deleted, words_inserted, words_deleted]
+            per_query (list(list(int))): n_queries x 4
+            per_file (list(list(int))): n_files x 4
+        '''
+        if n_queries is None: n_queries = max(self.iquery) + 1 if len(self) > 0 else 0
+        if n_files is None: n_files = max(self.ifile) + 1 if len(self) > 0 else 0
+        if np is not None:
+            metrics = [np.frombuffer(column, dtype=np.intc) for column in self.metrics()]
+            total = [int(column.sum(dtype=np.int64)) for column in metrics]
+            per_query = _bincount_matrix(np.frombuffer(self.iquery, dtype=np.intc), metrics, n_queries)
+            per_file = _bincount_matrix(np.frombuffer(self.ifile, dtype=np.intc), metrics, n_files)
+            return total, per_query.tolist(), per_file.tolist()
+        total = [0, 0, 0, 0]
+        per_query = [[0, 0, 0, 0] for i in range(n_queries)]
+        per_file = [[0, 0, 0, 0] for i in range(n_files)]
+        for ifile, iquery, lines_inserted, lines_deleted, words_inserted, words_deleted in zip(self.ifile, self.iquery, *self.metrics()):
+            for entry in (total, per_query[iquery], per_file[ifile]):
+                entry[0] += lines_inserted; entry[1] += lines_deleted
+                entry[2] += words_inserted; entry[3] += words_deleted
+        return total, per_query, per_file
+
+    def entries_of(self, ifile):
+        '''Positions of the entries of the file
+
+        The index of all the files is extended with the entries appended since
+        the last call, so getting the entries of every file is O(entries).
+        '''
+        for i in range(self.n_indexed, len(self.ifile)):
+            while self.ifile[i] >= len(self.by_file): self.by_file.append(array('i'))
+            self.by_file[self.ifile[i]].append(i)
+        self.n_indexed = len(self.ifile)
+        return self.by_file[ifile] if ifile < len(self.by_file) else array('i')
+
+    def queries_of(self, ifile):
+        '''Set of iquery of the entries of the file'''
+        return set(self.iquery[i] for i in self.entries_of(ifile))
+
+    def stats_of(self, ifile):
+        '''List of Stat of the entries of the file'''
+        return [Stat(self.iquery[i], self.lines_inserted[i], self.lines_deleted[i], self.words_inserted[i], self.words_deleted[i])
+            for i in self.entries_of(ifile)]
+
+class FileCommits:
+    '''Commits (of an author) and the files they touch, by ordinal
+
+    The ordinal of a commit is its position in the walk (see dispatch_stats()),
+    so the commits are plain integers in arrays instead of sets of Oid: commits
+    has one entry for each commit, and (ifile, icommit) one entry for each file
+    of a commit. Distinct commits of each file are sorted arrays.
+
+    Example:
+        fake = FileCommits()
+        fake.append_commit(icommit, [ifile1, ifile2])
+        n_fake_commits = fake.n_commits()
+        fake_commits_of_files = fake.distinct(n_files) # list(array('i'))
+    '''
+    __slots__ = ('commits', 'ifile', 'icommit')
+
+    def __init__(self):
+        self.commits = array('i')
+        self.ifile = array('i')
+        self.icommit = array('i')
+
+    def copy(self):
+        other = FileCommits()
+        for name in self.__slots__:
+            getattr(other, name).extend(getattr(self, name))
+        return other
+
+    def append(self, ifile, icommit):
+        self.ifile.append(ifile)
+        self.icommit.append(icommit)
+
+    def append_commit(self, icommit, ifiles):
+        self.commits.append(icommit)
+        for ifile in ifiles:
+            self.append(ifile, icommit)
+
+    def n_commits(self):
+        '''Number of distinct commits'''
+        return len(set(self.commits))
+
+    def distinct(self, n_files):
+        '''Sorted distinct commits of each file (list(array('i')))'''
+        return _distinct_commits(self.ifile, self.icommit, n_files)
+
+def _distinct_commits(ifiles, icommits, n_files):
+    '''Sorted distinct icommit of each file from the parallel arrays of (ifile, icommit)
+
+    With numpy, the pairs are packed into int64 keys and sorted once by np.unique().
+    '''
+    if np is not None and len(ifiles) > 0:
+        keys = np.unique((np.frombuffer(ifiles, dtype=np.intc).astype(np.int64) << 32) | np.frombuffer(icommits, dtype=np.intc).astype(np.int64))
+        bounds = np.searchsorted(keys >> 32, np.arange(n_files + 1))
+        icommits = (keys & 0xffffffff).astype(np.intc)
+        return [array('i', icommits[lo:hi].tobytes()) for lo, hi in zip(bounds[:-1], bounds[1:])]
+    commits = [set() for i in range(n_files)]
+    for ifile, icommit in zip(ifiles, icommits):
+        commits[ifile].add(icommit)
+    return [array('i', sorted(icommits)) for icommits in commits]
+
+def _bincount_matrix(keys, metrics, n):
+    '''Sum of each metric (list of numpy columns) by keys, as a n x len(metrics) numpy array'''
+    matrix = np.zeros((n, len(metrics)), dtype=np.int64)
+    for i, column in enumerate(metrics):
+        matrix[:, i] = np.bincount(keys, weights=column, minlength=n)[:n] # exact in float64 below 2**53
+    return matrix
+
 class FileStat:
     '''Statistics of a file
 
-    .....
-
-    TODO: deal with renaming
+    The stats are stored in the StatColumns of the author (with ifile as the
+    index of this file), or in its own columns if it is used alone. Renamed
+    files are followed by the author (see Author.follow_renames()).
     '''
-    def __init__(self, filepath):
-        self.stats = list() # list of Stat (several stats from multiple queries)
+    __slots__ = ('filepath', 'fileext', 'criteria', 'columns', 'ifile')
+
+    def __init__(self, filepath, columns=None, ifile=0):
         self.filepath = filepath # use filepath as key
+        self.columns = columns if columns is not None else StatColumns()
+        self.ifile = ifile
         # ensure criteria for scoring
         self.fileext = os.path.splitext(filepath)[1].lower() # fileext always case insensitive
-        if self.fileext in FILEEXT_TEXT:                        self.criteria = 0
-        elif self.fileext in FILEEXT_CODE:                      self.criteria = 1
-        elif self.fileext in FILEEXT_FIGURE_VECTOR:             self.criteria = 10
-        elif self.fileext in FILEEXT_FIGURE_BITMAP_LOSSLESS:    self.criteria = 11
-        elif self.fileext in FILEEXT_FIGURE_BITMAP_LOSSY:       self.criteria = 12
-        else:                                                   self.criteria = -1
-        
+        self.criteria = _get_criteria(self.fileext)
+
+    @property
+    def stats(self):
+        '''List of Stat (several stats from multiple queries), created from the columns'''
+        return self.columns.stats_of(self.ifile)
+
+    def append(self, iquery, lines_inserted, lines_deleted, words_inserted, words_deleted):
+        '''Append the stat of a patch (in one commit)'''
+        self.columns.append(self.ifile, iquery, lines_inserted, lines_deleted, words_inserted, words_deleted)
+
     def parse_append(self, iquery, patch_hunks, patch_status):
         '''Parse a patch in diff (in one commit), and append the stat'''
-        lines_inserted, lines_deleted, words_inserted, words_deleted = 0, 0, 0, 0
-        if self.criteria == 0 or self.criteria == 1:
-            for hunk in patch_hunks:
-                for line in hunk.lines:
-                    words_diff = len(re.findall(PATTERN_WORD, line.content))
-                    if words_diff == 0:         continue # exclude empty line, whitespace change, single linebreak
-                    if line.origin == '+':      lines_inserted += 1; words_inserted += words_diff
-                    elif line.origin == '-':    lines_deleted += 1;  words_deleted += words_diff
-            if self.fileext == '.bib':
-                lines_inserted, lines_deleted, words_deleted = 0, 0, 0
-                if words_inserted > EQUIVWORDS_BIB_MAX: words_inserted = EQUIVWORDS_BIB_MAX
-        elif self.criteria == 10:
-            words_inserted, words_deleted = (0, EQUIVWORDS_FIGURE_VECTOR) if patch_status == 2 else (EQUIVWORDS_FIGURE_VECTOR, 0) # deleeted; added or modified
-        elif self.criteria == 11:
-            words_inserted, words_deleted = (0, EQUIVWORDS_FIGURE_BITMAP_LOSSLESS) if patch_status == 2 else (EQUIVWORDS_FIGURE_BITMAP_LOSSLESS, 0) # deleeted; added or modified
-        elif self.criteria == 12:
-            words_inserted, words_deleted = (0, EQUIVWORDS_FIGURE_BITMAP_LOSSY) if patch_status == 2 else (EQUIVWORDS_FIGURE_BITMAP_LOSSY, 0) # deleeted; added or modified
-        # append data
-        self.stats.append(Stat(iquery, lines_inserted, lines_deleted, words_inserted, words_deleted))
+        counts = _count_hunks(patch_hunks) if self.criteria == 0 or self.criteria == 1 else None
+        self.append(iquery, *_parse_patch(self.criteria, self.fileext, patch_status, counts))
+
+def walk_commits(repo, target, since=None, slack=timedelta(days=1), hide=()):
+    '''Walk the history from target (newest first) and stop at commits older than since
+
+    Commits are yielded one by one in time order, so only the queried window is
+    loaded instead of the whole history. The slack allows some clock skew of the
+    commits (a parent committed "after" its child).
+
+    Example:
+        commits = walk_commits(repo, repo.head.target, since=min(since for since, until in durations))
+        new_commits = walk_commits(repo, repo.head.target, hide=[old_tip]) # e.g. in watch.py
+
+    Args:
+        repo (pygit2.Repository):
+        target (pygit2.Oid): Commit to start from
+        since (datetime): Earliest time of the queries (None to walk the whole history)
+        slack (timedelta): Keep walking for commits within slack before since
+        hide (iterable(pygit2.Oid)): Commits (and their ancestors) already processed
+
+    Returns:
+        commits (generator(pygit2.Commit)):
+    '''
+    walker = repo.walk(target, git.GIT_SORT_TIME)
+    for commit_id in hide:
+        walker.hide(commit_id)
+    t_stop = (since - slack).timestamp() if since is not None else None
+    for commit in walker:
+        if t_stop is not None and commit.commit_time < t_stop: break
+        metrics.count('commits walked')
+        yield commit
+
+class DiffFilter:
+    '''Files which are diffed in diff_commit(), and how
+
+    Files excluded by the patterns, or larger than max_size (text and code,
+    which are patched), are checked before their patches are generated and get
+    an entry with the status only (no lines and words).
+
+    The profile (key of DIFF_PROFILES) sets the options of repo.diff(), so
+    context lines (and blank lines and whitespace changes with the whitespace
+    profile) are dropped by libgit2 instead of being generated and skipped in
+    _count_patch().
+
+    With renames (or copies), a moved file is one entry with its old path and
+    only the changes of its content are counted (see _find_renames()).
+
+    Patterns are fnmatch patterns of the whole path ('*' also matches '/'), and
+    a pattern also matches the files in the folder of the same path, e.g.
+    'vendor', 'lib/*/dist/', '*.min.js'.
+
+    Example:
+        diff_filter = DiffFilter(exclude=['vendor', '*.min.js'], max_size=1 << 20)
+        filestats = diff_commit(repo, commit, diff_filter)
+
+    Args:
+        include (list(str)): Only diff the files matching one of them (all files if empty)
+        exclude (list(str)): Do not diff the files matching one of them
+        max_size (int): Do not patch the files larger than it (bytes of old or new blob), None for no limit
+        profile (str): Options of repo.diff() (key of DIFF_PROFILES)
+        renames (bool): Detect renamed files
+        copies (bool): Detect copied files (from the deleted and modified files)
+        rename_limit (int): Maximum pairs of candidates for the similarity (exact renames only if more)
+        rename_threshold (int): Similarity (%) of renames and copies
+        rename_max_size (int): Maximum size of the candidates for the similarity (exact renames only if larger)
+    '''
+    __slots__ = ('include', 'exclude', 'max_size', 'profile', 'options', 'renames', 'copies', 'rename_limit', 'rename_threshold',
+        'rename_max_size', 'key', 'pattern_include', 'pattern_exclude')
+
+    def __init__(self, include=(), exclude=(), max_size=None, profile=DIFF_PROFILE,
+            renames=False, copies=False, rename_limit=RENAME_LIMIT, rename_threshold=RENAME_THRESHOLD, rename_max_size=RENAME_MAX_SIZE):
+        assert profile in DIFF_PROFILES, 'Unknown diff profile: %s' % (profile)
+        self.include = sorted(include)
+        self.exclude = sorted(exclude)
+        self.max_size = max_size
+        self.profile = profile
+        self.options = DIFF_PROFILES[profile]
+        self.renames = renames
+        self.copies = copies
+        self.rename_limit = rename_limit
+        self.rename_threshold = rename_threshold
+        self.rename_max_size = rename_max_size
+        # part of the version of stats in StatsStore ('' by default, so stats stored before are still used)
+        key = [self.include, self.exclude, max_size] + ([profile] if profile != DIFF_PROFILE else [])
+        if renames or copies: key.append([renames, copies, rename_limit, rename_threshold, rename_max_size])
+        self.key = '' if self.is_empty() else ' ' + json.dumps(key)
+        self.pattern_include = self._compile(self.include)
+        self.pattern_exclude = self._compile(self.exclude)
+
+    @staticmethod
+    def _compile(patterns):
+        if len(patterns) == 0: return None
+        return re.compile('|'.join('(?:%s)|(?:%s)' % (fnmatch.translate(pattern.rstrip('/')), fnmatch.translate(pattern.rstrip('/') + '/*'))
+            for pattern in patterns))
+
+    def is_empty(self):
+        return (len(self.include) == 0 and len(self.exclude) == 0 and self.max_size is None and self.profile == DIFF_PROFILE and
+                not self.renames and not self.copies)
+
+    def skip_path(self, filepath):
+        '''True if the file is not included or is excluded'''
+        return ((self.pattern_include is not None and self.pattern_include.match(filepath) is None) or
+                (self.pattern_exclude is not None and self.pattern_exclude.match(filepath) is not None))
+
+    def skip_size(self, repo, delta):
+        '''True if the old or new blob of the delta is larger than max_size (sizes from the object headers)'''
+        if self.max_size is None: return False
+        return any(_blob_size(repo, diff_file) > self.max_size for diff_file in (delta.old_file, delta.new_file))
+
+def _blob_size(repo, diff_file):
+    if diff_file.size > 0 or diff_file.id.raw == b'\x00' * 20: return diff_file.size # known, or no blob (added / deleted)
+    try:
+        return repo.odb.read_header(diff_file.id)[1] # without reading the content if possible
+    except AttributeError: # old pygit2
+        return repo[diff_file.id].size
+
+def _find_renames(repo, diff, deltas, diff_filter):
+    '''Detect renamed (and copied) files in the deltas of a diff
+
+    Exact renames (the blob of a deleted file is added) are paired from the ids
+    of the blobs, without reading them. The similarity of the other candidates
+    is computed by libgit2 (diff.find_similar()) only if there are at most
+    rename_limit pairs of them and none is larger than rename_max_size, so
+    commits moving many (or large) files only get their exact renames.
+
+    Returns:
+        deltas (list(pygit2.DiffDelta)): Deltas of the diff (with the renames and copies if found by libgit2)
+        exact (dict): Path of the added file -> path of the deleted file, for exact renames not found by libgit2
+    '''
+    deleted = dict() # blob id -> paths of the deleted files
+    if diff_filter.renames:
+        for delta in deltas:
+            if delta.status == 2: deleted.setdefault(delta.old_file.id, []).append(delta.old_file.path)
+    exact, targets = dict(), []
+    for delta in deltas:
+        if delta.status != 1: continue
+        paths = deleted.get(delta.new_file.id)
+        if paths:   exact[delta.new_file.path] = paths.pop()
+        else:       targets.append(delta.new_file)
+    sources = [delta.old_file for delta in deltas if # deleted files not paired yet, modified files for copies
+        (delta.status == 2 and delta.old_file.path in deleted.get(delta.old_file.id, ())) or (delta.status == 3 and diff_filter.copies)]
+    if len(sources) == 0 or len(targets) == 0 or len(sources) * len(targets) > diff_filter.rename_limit or \
+            any(_blob_size(repo, diff_file) > diff_filter.rename_max_size for diff_file in sources + targets):
+        return deltas, exact
+    flags = (git.GIT_DIFF_FIND_RENAMES if diff_filter.renames else 0) | (git.GIT_DIFF_FIND_COPIES if diff_filter.copies else 0)
+    diff.find_similar(flags, rename_threshold=diff_filter.rename_threshold, copy_threshold=diff_filter.rename_threshold,
+        rename_limit=diff_filter.rename_limit)
+    metrics.count('similarity runs')
+    return list(diff.deltas), dict()
+
+def _diff_deltas(repo, diff, diff_filter):
+    '''(index of the patch, delta, filepath, status, oldpath, changed) of each file in the diff
+
+    With the renames (and copies) of diff_filter, an exact rename is one entry
+    of status 4 (the deleted file is dropped), and changed is False if the
+    content of a renamed or copied file is the same.
+    '''
+    deltas, exact = diff.deltas, dict()
+    if diff_filter is not None and (diff_filter.renames or diff_filter.copies):
+        deltas, exact = _find_renames(repo, diff, list(deltas), diff_filter)
+    renamed = set(exact.values())
+    for i, delta in enumerate(deltas):
+        filepath, status = delta.new_file.path, delta.status
+        if status == 2 and filepath in renamed: continue # in the entry of the added file (exact rename)
+        if status == 1 and filepath in exact:   yield i, delta, filepath, 4, exact[filepath], False
+        elif status == 4 or status == 5:        yield i, delta, filepath, status, delta.old_file.path, delta.old_file.id != delta.new_file.id
+        else:                                   yield i, delta, filepath, status, None, True
+
+def diff_paths(repo, commit, diff_filter=None):
+    '''Files of a (non-merge) commit with their status, from the deltas only
+
+    No patch is generated, and the result is not stored (see StatsStore), so
+    it is cheap to list the files of the commits which are not scored (fake
+    and invalid commits) and to find the renames in the commits of others.
+
+    Returns:
+        filestats (tuple(tuple)): Same as diff_commit(), with 0 for lines and words
+    '''
+    with metrics.timer('diff paths'):
+        diff = repo.diff(commit.parents[0], commit, **(diff_filter.options if diff_filter is not None else DIFF_PROFILES[DIFF_PROFILE]))
+        filestats = tuple((filepath, status, 0, 0, 0, 0, oldpath) for i, delta, filepath, status, oldpath, changed in _diff_deltas(repo, diff, diff_filter))
+    metrics.count('commits listed')
+    return filestats
+
+def diff_commit(repo, commit, diff_filter=None):
+    '''Diff a (non-merge) commit with its parent and parse the patches
+
+    Only deltas (path and status) are read for every file. The textual patch
+    is generated only for the files whose criteria count lines and words (text
+    and code); figures, binary and other files are scored from the delta.
+    Files skipped by diff_filter get the status only, so do renamed and copied
+    files with the same content.
+
+    Example:
+        filestats = diff_commit(repo, commit)
+
+    Args:
+        repo (pygit2.Repository):
+        commit (pygit2.Commit):
+        diff_filter (DiffFilter): Files to skip and profile, None to diff all the files (with DIFF_PROFILE)
+
+    Returns:
+        filestats (tuple(tuple)): (filepath, status, lines_inserted, lines_deleted, words_inserted, words_deleted, oldpath)
+            for each file in the commit. The numbers are 0 if status is not add, delete, modify, rename or copy.
+            oldpath is None if status is not rename (4) or copy (5).
+    '''
+    filestats = []
+    n_patches, n_bytes, n_lines, n_skipped, n_renames = 0, 0, 0, 0, 0
+    with metrics.timer('diff'):
+        diff = repo.diff(commit.parents[0], commit, **(diff_filter.options if diff_filter is not None else DIFF_PROFILES[DIFF_PROFILE]))
+        for i, delta, filepath, status, oldpath, changed in _diff_deltas(repo, diff, diff_filter):
+            if oldpath is not None: n_renames += 1
+            if diff_filter is not None and diff_filter.skip_path(filepath):
+                n_skipped += 1
+                filestats.append((filepath, status, 0, 0, 0, 0, oldpath))
+            elif status > 0 and status < 6 and changed: # add, delete, modify (including binary), rename and copy with changes
+                fileext = os.path.splitext(filepath)[1].lower() # fileext always case insensitive
+                criteria = _get_criteria(fileext)
+                counts = None
+                if (criteria == 0 or criteria == 1) and diff_filter is not None and diff_filter.skip_size(repo, delta):
+                    n_skipped += 1
+                    filestats.append((filepath, status, 0, 0, 0, 0, oldpath))
+                    continue
+                if criteria == 0 or criteria == 1: # patch only if needed
+                    data = diff[i].data
+                    counts = _count_patch(data)
+                    n_patches += 1; n_bytes += len(data); n_lines += data.count(b'\n')
+                filestats.append((filepath, status) + _parse_patch(criteria, fileext, status, counts) + (oldpath,))
+            else:
+                filestats.append((filepath, status, 0, 0, 0, 0, oldpath))
+    metrics.count('commits diffed')
+    metrics.count('files diffed', len(filestats))
+    metrics.count('patches generated', n_patches)
+    metrics.count('files skipped', n_skipped)
+    metrics.count('files renamed', n_renames)
+    metrics.count('bytes scanned', n_bytes)
+    metrics.count('lines scanned', n_lines)
+    return tuple(filestats)
+
+_worker_repo = None # repository opened by each process of diff_pool()
+_worker_filter = None
+
+def _init_diff_worker(path, diff_filter):
+    global _worker_repo, _worker_filter
+    _worker_repo = git.Repository(path)
+    _worker_filter = diff_filter
+
+def _diff_commit_worker(commit_hex):
+    metrics.clear() # return the metrics of this commit only
+    filestats = diff_commit(_worker_repo, _worker_repo[commit_hex], _worker_filter)
+    return commit_hex, filestats, metrics.to_dict()
+
+def diff_pool(repo, jobs, diff_filter=None):
+    '''Create a process pool to run diff_commit() in parallel
+
+    Each process opens its own repository and returns the (picklable) filestats,
+    so the results are the same as diffing in the main process.
+
+    Example:
+        with diff_pool(repo, 8) as pool:
+            cache.prefetch(repo, commit_ids, pool)
+
+    Args:
+        repo (pygit2.Repository):
+        jobs (int): Number of processes
+        diff_filter (DiffFilter):
+
+    Returns:
+        pool (concurrent.futures.ProcessPoolExecutor):
+    '''
+    # fork if possible, so the processes start without importing the scripts again
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    return ProcessPoolExecutor(jobs, mp_context=context, initializer=_init_diff_worker, initargs=(repo.path, diff_filter))
+
+class StatsStore:
+    '''Persistent stats of commits (results of diff_commit()) in a SQLite file
+
+    Diffs of a commit never change, so a run only needs to diff the commits
+    which are not stored yet. Stats are keyed by commit id and version
+    (SCORING_VERSION and the options of diff_commit(), see CommitStatsCache).
+    The file can be shared by several processes (e.g. a cron job and watch.py):
+    a writer waits for the lock up to timeout seconds, and the stats of a commit
+    are only inserted by the first process which puts it.
+
+    Example:
+        store = StatsStore(os.path.join(repo.path, 'gitstat.sqlite'))
+        cache = CommitStatsCache(store=store)
+        ...
+        store.close()
+
+    Args:
+        path (str): Path of the SQLite file
+        version (str): Version of the scoring rules
+        commit_every (int): Number of puts before writing to the disk
+        timeout (float): Seconds to wait for the lock held by another process
+    '''
+    def __init__(self, path, version=str(SCORING_VERSION), commit_every=1000, timeout=60):
+        self.path = path
+        self.version = version
+        self.commit_every = commit_every
+        self.n_pending = 0
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        self.conn.executescript(
+            'CREATE TABLE IF NOT EXISTS commits ('
+                'commit_id BLOB, version TEXT, PRIMARY KEY (commit_id, version));'
+            'CREATE TABLE IF NOT EXISTS filestats ('
+                'commit_id BLOB, version TEXT, filepath TEXT, status INTEGER, '
+                'lines_inserted INTEGER, lines_deleted INTEGER, words_inserted INTEGER, words_deleted INTEGER, oldpath TEXT);'
+            'CREATE INDEX IF NOT EXISTS filestats_commit ON filestats (commit_id, version);'
+        )
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] < STORE_SCHEMA:
+            if 'oldpath' not in [row[1] for row in self.conn.execute('PRAGMA table_info(filestats)')]:
+                self.conn.execute('ALTER TABLE filestats ADD COLUMN oldpath TEXT') # stored without renames
+            if 'version' not in [row[1] for row in self.conn.execute('PRAGMA table_info(diaries)')]:
+                self.conn.execute('DROP TABLE IF EXISTS diaries') # dates of unknown version, parsed again
+            self.conn.execute('PRAGMA user_version = %d' % (STORE_SCHEMA))
+            self.conn.commit()
+        self.conn.execute('CREATE TABLE IF NOT EXISTS diaries (blob_id BLOB, version TEXT, dates TEXT, PRIMARY KEY (blob_id, version))')
+        self.diary_version = '%d %s' % (DIARY_VERSION, dateutil.__version__) # the dates also depend on dateutil
+
+    def get(self, commit_id, version=None):
+        '''Stored filestats of the commit (of version, self.version by default), None if not stored'''
+        key = (commit_id.raw, version if version is not None else self.version)
+        if self.conn.execute('SELECT 1 FROM commits WHERE commit_id=? AND version=?', key).fetchone() is None:
+            return None
+        return tuple(self.conn.execute(
+            'SELECT filepath, status, lines_inserted, lines_deleted, words_inserted, words_deleted, oldpath '
+            'FROM filestats WHERE commit_id=? AND version=? ORDER BY rowid', key))
+
+    def put(self, commit_id, filestats, version=None):
+        key = (commit_id.raw, version if version is not None else self.version)
+        if self.conn.execute('INSERT OR IGNORE INTO commits VALUES (?, ?)', key).rowcount == 0:
+            return # put by another process (or before)
+        self.conn.executemany('INSERT INTO filestats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (key + filestat for filestat in filestats))
+        self.n_pending += 1
+        if self.n_pending >= self.commit_every:
+            self.commit()
+
+    def get_diary(self, blob_id):
+        '''Stored dates (list(datetime.date)) of the diary blob, None if not stored'''
+        row = self.conn.execute('SELECT dates FROM diaries WHERE blob_id=? AND version=?', (blob_id.raw, self.diary_version)).fetchone()
+        return [datetime.strptime(date, '%Y-%m-%d').date() for date in json.loads(row[0])] if row is not None else None
+
+    def put_diary(self, blob_id, dates):
+        self.conn.execute('INSERT OR REPLACE INTO diaries VALUES (?, ?, ?)', (blob_id.raw, self.diary_version, json.dumps([date.isoformat() for date in dates])))
+
+    def commit(self):
+        self.conn.commit()
+        self.n_pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+class CommitStatsCache:
+    '''Cache of diff_commit() keyed by commit id
+
+    The stats of a commit never change, so they are computed once and shared by
+    all the authors and queries containing the commit. At most maxsize commits
+    are kept (least recently used ones are dropped). With a StatsStore, missed
+    commits are looked up in (and saved to) the store before diffing.
+
+    Example:
+        cache = CommitStatsCache(maxsize=4096)
+        filestats = cache.get(repo, commit.id)
+
+    Args:
+        maxsize (int):
+        store (StatsStore):
+        diff_filter (DiffFilter): Options of diff_commit(), stored as another version of stats
+    '''
+    def __init__(self, maxsize=4096, store=None, diff_filter=None):
+        self.maxsize = maxsize
+        self.store = store
+        self.diff_filter = diff_filter if diff_filter is not None and not diff_filter.is_empty() else None
+        self.version = (store.version if store is not None else str(SCORING_VERSION)) + (self.diff_filter.key if self.diff_filter is not None else '')
+        self.entries = OrderedDict() # commit id -> filestats
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+
+    def get(self, repo, commit_id):
+        filestats = self.entries.get(commit_id)
+        if filestats is not None:
+            self.hits += 1
+            self.entries.move_to_end(commit_id)
+            return filestats
+        self.misses += 1
+        filestats = self._get_stored(commit_id)
+        if filestats is None:
+            filestats = diff_commit(repo, repo[commit_id], self.diff_filter) # only load the commit if needed
+            if self.store is not None: self.store.put(commit_id, filestats, self.version)
+        self._insert(commit_id, filestats)
+        return filestats
+
+    def prefetch(self, repo, commit_ids, pool, chunksize=16):
+        '''Diff the commits which are not cached yet with a process pool (from diff_pool())
+
+        Commits should be fewer than maxsize, otherwise some of them are dropped before used.
+        '''
+        missing = []
+        for commit_id in commit_ids:
+            if commit_id in self.entries: continue
+            self.misses += 1
+            filestats = self._get_stored(commit_id)
+            if filestats is None:   missing.append(str(commit_id))
+            else:                   self._insert(commit_id, filestats)
+        for commit_hex, filestats, worker_metrics in pool.map(_diff_commit_worker, missing, chunksize=chunksize): # in order
+            metrics.merge(worker_metrics)
+            commit_id = git.Oid(hex=commit_hex)
+            if self.store is not None: self.store.put(commit_id, filestats, self.version)
+            self._insert(commit_id, filestats)
+
+    def _get_stored(self, commit_id):
+        filestats = self.store.get(commit_id, self.version) if self.store is not None else None
+        if filestats is not None: self.store_hits += 1
+        return filestats
+
+    def _insert(self, commit_id, filestats):
+        self.entries[commit_id] = filestats
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
 
 def _make_commit_filter(emails, since, until, author_commits, fake_commits):
     '''Create filter function to filter out invalid commits
     '''
+    since, until = since.timestamp(), until.timestamp() # compare with commit_time (epoch seconds)
     def is_valid_commit(commit):
-        t = datetime.fromtimestamp(float(commit.commit_time), timezone(timedelta(minutes=commit.commit_time_offset)))
-        return (len(commit.parents) == 1 and        # non-merge
+        t = commit.commit_time
+        return (len(commit.parent_ids) == 1 and     # non-merge
                 t > since and t < until and         # within duration
                 commit.id not in fake_commits and   # not fake commit (set)
                 (commit.committer.email in emails or commit.id in author_commits))  # same email or is labelled
     return is_valid_commit
 
+class CommitIndex:
+    '''Commits of a walk sorted by time, in compact columns
+
+    Built once per walk, so the range of a query is found by binary search on
+    the commit times instead of checking every commit. Commits with the same
+    time keep the order of the walk when iterated from newest to oldest.
+
+    Example:
+        index = CommitIndex(walk_commits(repo, repo.head.target))
+        lo, hi = index.slice(since, until)
+        commits = [repo[index.id(i)] for i in range(lo, hi)]
+
+    Attributes:
+        times (array('q')): Commit time (epoch seconds), ascending
+        n_parents (array('B')): Number of parents (capped at 255)
+        emails (array('i')): Committer email, index in email_names
+        email_names (list(str)):
+        raw_ids (bytes): Raw commit ids (20 bytes each)
+    '''
+    def __init__(self, commits):
+        times, n_parents, emails, raw_ids = [], [], [], []
+        email_ids = dict()
+        for commit in commits:
+            times.append(commit.commit_time)
+            n_parents.append(min(len(commit.parent_ids), 255))
+            emails.append(email_ids.setdefault(commit.committer.email, len(email_ids)))
+            raw_ids.append(commit.id.raw)
+        order = sorted(range(len(times)), key=lambda i: (times[i], -i)) # reversed walk order if same time
+        self.times = array('q', (times[i] for i in order))
+        self.n_parents = array('B', (n_parents[i] for i in order))
+        self.emails = array('i', (emails[i] for i in order))
+        self.email_names = sorted(email_ids, key=email_ids.get)
+        self.raw_ids = b''.join(raw_ids[i] for i in order)
+
+    def __len__(self):
+        return len(self.times)
+
+    def raw_id(self, i):
+        return self.raw_ids[20 * i:20 * i + 20]
+
+    def id(self, i):
+        return git.Oid(raw=self.raw_id(i))
+
+    def slice(self, since, until):
+        '''Range (lo, hi) of the commits with since < commit time < until'''
+        return bisect_right(self.times, since.timestamp()), bisect_left(self.times, until.timestamp())
+
+    def commits(self, repo, lo=0, hi=None):
+        '''Commits in range(lo, hi), newest first'''
+        for i in range(len(self) if hi is None else hi - 1, lo - 1, -1):
+            yield repo[self.id(i)]
+
+def parse_date(line):
+    '''Date of a simple heading by PATTERN_DATE_HEADING, same as dateutil.parser.parse(line, fuzzy=True).date()
+
+    A simple heading is a date in a common format with some words around it, e.g.
+    '# Monday, 2017-09-08', '## Sep 8th, 2017 - meeting', '# 08/09/2017'.
+
+    Returns:
+        date (datetime.date): None if the line is not a simple heading (use dateutil)
+    '''
+    m = PATTERN_DATE_HEADING.fullmatch(line)
+    if m is None:
+        return None
+    g = m.groupdict()
+    for words in (g['pre'], g['post']):
+        if words is not None and any(word.lower() in _DATE_WORDS for word in words.split()):
+            return None # dateutil may use the words
+    if g['y1'] is not None:
+        year, month, day = int(g['y1']), int(g['m1']), int(g['d1'])
+    elif g['y2'] is not None:
+        month, day = int(g['a2']), int(g['b2'])
+        if month > 12: month, day = day, month # day first only if it cannot be a month (as dateutil)
+        year = int(g['y2'])
+    elif g['sep'] is not None and (':' in g['sep'] or g['sep'] == '-'):
+        return None # dateutil reads '2017: ...' as a time, and fails on '2017-notes', after a month name
+    elif g['y3'] is not None:
+        year, month, day = int(g['y3']), _MONTHS[g['m3'].lower()], int(g['d3'])
+    else:
+        year, month, day = int(g['y4']), _MONTHS[g['m4'].lower()], int(g['d4'])
+    try: return datetime(year, month, day).date()
+    except ValueError: return None # invalid date, let dateutil decide
+
+def parse_diary(data):
+    '''Dates in the headings (lines starting with '#') of a diary
+
+    Args:
+        data (bytes): Content of the diary (utf-8)
+
+    Returns:
+        dates (list(datetime.date)):
+    '''
+    dates = []
+    for line in io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', errors='replace'): # same lines as open(..., 'r')
+        if line.startswith('#') and PATTERN_DATE_TOKEN.search(line):
+            date = parse_date(line)
+            if date is not None: dates.append(date); continue
+            try: dates.append(dateutil.parser.parse(line, fuzzy=True).date())
+            except ValueError: pass # pass if cannot parse date correctly
+    return dates
+
+_diary_dates = {} # blob id -> dates, parsed diaries of this process
+
+def diary_dates(data, blob_id=None, store=None):
+    '''parse_diary() cached by blob id (in memory and in the StatsStore), so an unchanged diary is parsed once
+
+    Args:
+        data (bytes): Content of the diary
+        blob_id (pygit2.Oid): Id of the blob, hashed from data if None
+        store (StatsStore):
+
+    Returns:
+        dates (list(datetime.date)):
+    '''
+    if blob_id is None:
+        blob_id = git.hash(data)
+    dates = _diary_dates.get(blob_id)
+    if dates is None and store is not None:
+        dates = store.get_diary(blob_id)
+    if dates is None:
+        metrics.count('diaries parsed')
+        dates = parse_diary(data)
+        if store is not None:
+            store.put_diary(blob_id, dates)
+    _diary_dates[blob_id] = dates
+    return dates
+
 class Author:
     def __init__(self, info, repo, case_sensitive=True):
         self.name = info['name']
@@ -190,64 +1254,158 @@ class Author:
         # statistics
         self.case_sensitive = case_sensitive # whether key to files[] case-sensitive
         self.files = dict() # dictionary of FileStat
+        self.renames = dict() # old path -> latest path of renamed files (see follow_renames())
+        self.columns = StatColumns() # stats of all the files (FileStat.ifile is the index in files)
         self.summary = None
         self.summary_duration = None # list of Stat
+        self.summary_files = None # list of Stat (same order as files)
         self.n_commits = 0 # to avoid count repeat commits for different files
+        self.n_walked = 0 # ordinals of the commits of the next dispatch_stats() start from it
+        self.fake = FileCommits() # fake commits (see dispatch_stats())
+        self.invalid = FileCommits() # merges and commits out of the queries (see dispatch_stats())
+        self.n_fake_commits = 0
+        self.n_invalid_commits = 0
+        self.summary_files_commits = None # list of (fake, invalid, valid) commits (same order as files)
         self.queries_with_commits = 0
+        self.query_commits = dict() # iquery -> number of commits (of the queries with commits)
         self.has_diary = None
 
-    def generate_stats(self, repo, commits, since, until, fake_commits, iquery=0):
+    def generate_stats(self, repo, commits, since, until, fake_commits, iquery=0, cache=None):
         '''Generate statistics of all the files in the commits of the author
 
         .....
 
         Args:
             repo (pygit2.Repository):
-            commits (list(pygit2.Object)): (commits = [commit for repo.walk(repo.head.target)])
+            commits (list(pygit2.Object)): (commits = [commit for repo.walk(repo.head.target)]) or CommitIndex
             since (...):
             until (...):
             fake_commits (set(str)):
             iquery (int):
+            cache (CommitStatsCache): Stats of commits shared with other authors and queries
 
         Notes:
             ...
         '''
         # get stats of files
+        if isinstance(commits, CommitIndex):
+            index, (lo, hi) = commits, commits.slice(since, until)
+            commits = ((i, repo[index.id(i)]) for i in range(hi - 1, lo - 1, -1)) # ordinal in the index
+        else:
+            commits = enumerate(commits)
         commit_filter = _make_commit_filter(self.emails, since, until, self.author_commits, fake_commits)
-        filtered_commits = list(filter(commit_filter, commits))
+        filtered_commits = [(icommit, commit) for icommit, commit in commits if commit_filter(commit)]
         n_commits = len(filtered_commits)
         if n_commits == 0: return
         # has some commits
         self.n_commits += n_commits
-        self.queries_with_commits += 1
-        for commit in filtered_commits:
-            diff = repo.diff(commit.parents[0], commit)
-            for patch in diff:
-                delta = patch.delta
-                filepath = delta.new_file.path if self.case_sensitive else delta.new_files.path.lower()
-                fileext = os.path.splitext(filepath)[1].lower() # fileext always case insensitvie
-                if filepath not in self.files:
-                    self.files[filepath] = FileStat(filepath)
-                if delta.status > 0 and delta.status < 4: # add, delete, modify (including binary)
-                    self.files[filepath].parse_append(iquery, patch.hunks, delta.status)
+        self.query_commits[iquery] = self.query_commits.get(iquery, 0) + n_commits
+        self.queries_with_commits = len(self.query_commits)
+        if cache is None: cache = CommitStatsCache()
+        for icommit, commit in filtered_commits:
+            filestats = cache.get(repo, commit.id)
+            self.append_stats(filestats, iquery, icommit)
+            self.follow_renames(filestats)
+
+    def append_stats(self, filestats, iquery=0, icommit=0):
+        '''Append the stats of the files (in one commit, from diff_commit()) to the author'''
+        for filepath, status, lines_inserted, lines_deleted, words_inserted, words_deleted, oldpath in filestats:
+            filestat = self.get_filestat(filepath)
+            if status > 0 and status < 6: # add, delete, modify (including binary), rename, copy
+                self.columns.append(filestat.ifile, iquery, lines_inserted, lines_deleted, words_inserted, words_deleted, icommit)
+
+    def append_commit(self, filestats, icommit, fake=False):
+        '''Append a fake or invalid commit (merge or out of the queries) to the files it touches, without stats'''
+        (self.fake if fake else self.invalid).append_commit(icommit, [self.get_filestat(filestat[0]).ifile for filestat in filestats])
+
+    def get_filestat(self, filepath):
+        '''FileStat of the file (of the latest path if renamed, see follow_renames()), added if not yet'''
+        if not self.case_sensitive: filepath = filepath.lower()
+        filepath = self.renames.get(filepath, filepath)
+        filestat = self.files.get(filepath)
+        if filestat is None:
+            filestat = self.files[filepath] = FileStat(filepath, self.columns, len(self.files))
+        return filestat
+
+    def follow_renames(self, filestats):
+        '''Append the stats of the old paths of the renamed files (in one commit) to their latest paths from now on
+
+        Commits are appended from newest to oldest, so the older commits of a
+        renamed file are kept with its latest path.
+        '''
+        for filestat in filestats:
+            if filestat[1] != 4: continue # not renamed
+            filepath, oldpath = (filestat[0], filestat[6]) if self.case_sensitive else (filestat[0].lower(), filestat[6].lower())
+            self.renames[oldpath] = self.renames.get(filepath, filepath)
+
+    def select(self, iqueries):
+        '''Author with the stats of some queries only (renumbered in the order of iqueries)
+
+        The files are the same (all the files touched by the commits of the
+        author), and the commits only in the other queries become invalid ones.
+
+        Example:
+            total = author.select([0]) # stats of query 0 only, as iquery 0
+        '''
+        author = copy.copy(self)
+        author.columns, author.invalid = StatColumns(), self.invalid.copy()
+        author.files = dict((key, FileStat(filestat.filepath, author.columns, filestat.ifile)) for key, filestat in self.files.items())
+        new_iqueries = dict((iquery, i) for i, iquery in enumerate(iqueries))
+        valid, others = set(), []
+        for entry in zip(self.columns.ifile, self.columns.iquery, *self.columns.metrics(), self.columns.icommit):
+            if entry[1] in new_iqueries:
+                author.columns.append(entry[0], new_iqueries[entry[1]], *entry[2:])
+                valid.add(entry[-1])
+            else:
+                others.append((entry[0], entry[-1]))
+        for ifile, icommit in others: # out of these queries
+            if icommit not in valid: author.invalid.append(ifile, icommit)
+        author.invalid.commits.extend(sorted(set(icommit for ifile, icommit in others) - valid))
+        author.query_commits = dict((new_iqueries[iquery], n) for iquery, n in self.query_commits.items() if iquery in new_iqueries)
+        author.n_commits = sum(author.query_commits.values())
+        author.queries_with_commits = len(author.query_commits)
+        author.has_diary = [self.has_diary[iquery] for iquery in iqueries] if self.has_diary is not None else None
+        author.summary = author.summary_duration = author.summary_files = author.summary_files_commits = None
+        return author
+
+    def summarize(self, n_queries):
+        # summaries for total, each duration and each file at once
+        total, per_query, per_file = self.columns.aggregate(n_queries, len(self.files))
+        self.summary = Stat(-1, *total)
+        self.summary_duration = [Stat(iquery, *entry) for iquery, entry in enumerate(per_query)]
+        self.summary_files = [Stat(-1, *entry) for entry in per_file]
+        # distinct commits of the author and each file
+        self.n_fake_commits = self.fake.n_commits()
+        self.n_invalid_commits = self.invalid.n_commits()
+        self.summary_files_commits = list(zip(self.fake.distinct(len(self.files)), self.invalid.distinct(len(self.files)),
+            _distinct_commits(self.columns.ifile, self.columns.icommit, len(self.files))))
 
     def get_summary(self):
         # summary for total
-        self.summary = Stat(-1, 0, 0, 0, 0)
-        for filestat in self.files.values():
-            for stat in filestat.stats:
-                self.summary += stat
+        self.summary = Stat(-1, *self.columns.aggregate()[0])
         return self.summary
 
     def get_summary_duration(self, durations):
         # summary for each duration
-        self.summary_duration = [Stat(-1, 0, 0, 0, 0) for i in range(len(durations))] # [Stat()]*N, all entries will point to same reference
-        for filestat in self.files.values():
-            for stat in filestat.stats:
-                self.summary_duration[stat.iquery] += stat
+        self.summarize(len(durations))
         return self.summary_duration
 
-    def check_diary(self, root, durations, check_file=False, check_content=False):
+    def get_summary_files(self):
+        # summary for each file (same order as files)
+        self.summary_files = [Stat(-1, *entry) for entry in self.columns.aggregate(None, len(self.files))[2]]
+        return self.summary_files
+
+    def check_diary(self, root, durations, check_file=False, check_content=False, tree=None, store=None):
+        '''Check which queries have diaries
+
+        Args:
+            root (str): Folder of the working tree (diary paths are relative to it)
+            durations (list(tuple(datetime, datetime))): (since, until) of the queries
+            check_file (bool): A query has diary if there are commits to a diary
+            check_content (bool): A query has diary if a date in a heading of a diary is in the duration
+            tree (pygit2.Tree): Read the diaries from the tree instead of root (for bare repositories)
+            store (StatsStore): Cache of the dates in the diaries (see diary_dates())
+        '''
         self.has_diary = [False for i in range(len(durations))]
         if self.diary is None:  print('No diary path'); return
         # check by commit to file
@@ -257,26 +1415,254 @@ class Author:
                 if key not in self.files:
                     print('No commits to diary')
                 else:
-                    for stat in self.files[key].stats:
-                        self.has_diary[stat.iquery] = True
+                    for iquery in self.columns.queries_of(self.files[key].ifile):
+                        self.has_diary[iquery] = True
         # check by diary content, go through the diary to find datetime
         if check_content:
             for diary in self.diary:
-                filepath = os.path.join(root, diary)
-                if not os.path.exists(filepath):
-                    print('No diary file:', diary)
+                if tree is not None:
+                    if diary not in tree:
+                        print('No diary file:', diary); continue
+                    blob = tree[diary]
+                    dates = diary_dates(blob.data, blob.id, store)
+                else:
+                    filepath = os.path.join(root, diary)
+                    if not os.path.exists(filepath):
+                        print('No diary file:', diary); continue
+                    with open(filepath, 'rb') as f:
+                        dates = diary_dates(f.read(), store=store)
+                if len(dates) > 0:
+                    dates = sorted(dates)
+                    duration_dates = ((d[0].date(), d[1].date()) for d in durations) # gen obj
+                    for iquery, (since, until) in enumerate(duration_dates):
+                        i = bisect_left(dates, since) # first date >= since
+                        if i < len(dates) and dates[i] <= until:
+                            self.has_diary[iquery] = True
                 else:
-                    dates = []
-                    with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-                        for line in f:
-                            if line.startswith('#'):
-                                try: dates.append(dateutil.parser.parse(line, fuzzy=True).date())
-                                except ValueError: pass # pass if cannot parse date correctly
-                    if len(dates) > 0:
-                        duration_dates = ((d[0].date(), d[1].date()) for d in durations) # gen obj
-                        for iquery, (since, until) in enumerate(duration_dates):
-                            if any((date >= since and date <= until) for date in dates):
-                                self.has_diary[iquery] = True
+                    print('Cannot find any date in diary:', diary)
+
+def dispatch_stats(repo, authors, commits, durations, fake_commits, cache=None, jobs=1):
+    '''Generate statistics of all the authors and queries in a single pass over the commits
+
+    Same results as calling Author.generate_stats() for every (author, query),
+    but each commit is checked and diffed only once. The queries are resolved
+    into ranges of the CommitIndex by binary search, and the owners of a commit
+    are found by the email of the committer or the labelled commits ("his commits").
+
+    Example:
+        n = dispatch_stats(repo, authors, repo.walk(repo.head.target), durations, fake_commits)
+
+    Args:
+        repo (pygit2.Repository):
+        authors (list(Author)):
+        commits (iterable(pygit2.Commit)): Commits to go through (only iterated once), or CommitIndex
+        durations (list(tuple(datetime, datetime))): (since, until) of each query
+        fake_commits (set(pygit2.Oid)):
+        cache (CommitStatsCache): Stats of commits (a new one if None)
+        jobs (int): Number of processes to diff the commits (see diff_pool())
+
+    Returns:
+        n (int): Number of commits gone through
+
+    Notes:
+        Commits are processed from newest to oldest. With jobs > 1, commits are
+        diffed in batches by the process pool, and then appended to the authors
+        in the same order as jobs == 1.
+        The other commits of the authors are recorded by ordinal (author.n_walked
+        + position in the index) for the commit counts of the files: fake commits,
+        and invalid ones (merges and commits out of the queries, but between the
+        earliest since and the latest until of durations, so the counts do not
+        depend on how far the commits are walked). Their files are
+        listed from the deltas only (see diff_paths()), and merges and root
+        commits are counted without files (the files of a merge are the commits
+        of its branch).
+        Renamed files are followed by all the authors, whoever renamed them: with
+        renames, the files of the other commits (no author, or out of the dates
+        of durations) are also listed from the deltas to find their renames.
+    '''
+    if isinstance(commits, CommitIndex):
+        index = commits
+    else:
+        with metrics.timer('walk'): index = CommitIndex(commits)
+    cache_counts = (cache.hits, cache.misses, cache.store_hits) if cache is not None else (0, 0, 0)
+    # index of owners
+    by_email = [[] for email in index.email_names]
+    email_ids = dict((email, i) for i, email in enumerate(index.email_names))
+    by_commit = dict()
+    for author in authors:
+        for email in author.emails:
+            if email in email_ids: by_email[email_ids[email]].append(author)
+        for commit_id in author.author_commits:
+            by_commit.setdefault(commit_id.raw, []).append(author)
+    fake_raw_ids = set(commit_id.raw for commit_id in fake_commits)
+    # ranges of the queries, split into segments covered by the same queries
+    spans = [index.slice(since, until) for since, until in durations]
+    first, last = (min(span[0] for span in spans), max(span[1] for span in spans)) if len(spans) > 0 else (0, 0)
+    bounds = sorted(set([0, len(index)] + [b for span in spans for b in span]))
+    segments = [(lo, hi, tuple(iquery for iquery, span in enumerate(spans) if span[0] <= lo and hi <= span[1]),
+        first <= lo and hi <= last) # counted from the earliest since to the latest until
+        for lo, hi in zip(bounds[:-1], bounds[1:])]
+    if cache is None: cache = CommitStatsCache()
+    VALID, INVALID, FAKE, RENAMES = range(4) # kinds of the commits of the owners, and of the others (renames only)
+    n_matched = [0, 0, 0]
+    pool = diff_pool(repo, jobs, cache.diff_filter) if jobs > 1 else None
+    follow = cache.diff_filter is not None and cache.diff_filter.renames
+    batch, batch_size = [], min(cache.maxsize, 64 * jobs) # (commit_id, owners, iqueries, i, kind)
+    def flush_batch():
+        if pool is not None:
+            with metrics.timer('prefetch'): cache.prefetch(repo, [entry[0] for entry in batch if entry[4] == VALID], pool)
+        for commit_id, owners, iqueries, i, kind in batch:
+            if kind == VALID:               filestats = cache.get(repo, commit_id)
+            elif index.n_parents[i] == 1:   filestats = diff_paths(repo, repo[commit_id], cache.diff_filter) # not scored, or not counted
+            else:                           filestats = () # merge or root commit
+            with metrics.timer('append'):
+                for author in owners:
+                    if kind == VALID:
+                        author.n_commits += len(iqueries)
+                        for iquery in iqueries:
+                            author.query_commits[iquery] = author.query_commits.get(iquery, 0) + 1
+                        for iquery in iqueries:
+                            author.append_stats(filestats, iquery, author.n_walked + i)
                     else:
-                        print('Cannot find any date in diary:', diary)
+                        author.append_commit(filestats, author.n_walked + i, fake=(kind == FAKE))
+                if follow and any(filestat[1] == 4 for filestat in filestats): # renamed for all the authors
+                    for author in authors: author.follow_renames(filestats)
+        del batch[:]
+    try:
+        with metrics.timer('dispatch'):
+            for lo, hi, iqueries, counted in reversed(segments):
+                if not counted and not follow: continue
+                for i in range(hi - 1, lo - 1, -1): # newest first
+                    raw_id = index.raw_id(i)
+                    owners = by_email[index.emails[i]]
+                    if raw_id in by_commit:
+                        owners = owners + [author for author in by_commit[raw_id] if author not in owners]
+                    if len(owners) == 0 or not counted:
+                        if follow and index.n_parents[i] == 1: # renamed files are followed by all the authors
+                            batch.append((git.Oid(raw=raw_id), [], iqueries, i, RENAMES))
+                            if len(batch) >= batch_size: flush_batch()
+                        continue
+                    if raw_id in fake_raw_ids: kind = FAKE
+                    elif index.n_parents[i] != 1 or len(iqueries) == 0: kind = INVALID # merge (or root), or out of the queries
+                    else: kind = VALID
+                    n_matched[kind] += 1
+                    batch.append((git.Oid(raw=raw_id), owners, iqueries, i, kind))
+                    if len(batch) >= batch_size: flush_batch()
+            flush_batch()
+    finally:
+        if pool is not None: pool.shutdown()
+    for author in authors:
+        author.queries_with_commits = len(author.query_commits)
+        author.n_walked += len(index)
+    metrics.count('commits indexed', len(index))
+    for name, n in zip(('commits matched', 'commits invalid', 'commits fake'), n_matched):
+        metrics.count(name, n)
+    for name, n0, n in zip(('cache hits', 'cache misses', 'store hits'), cache_counts, (cache.hits, cache.misses, cache.store_hits)):
+        metrics.count(name, n - n0)
+    return len(index)
+
+def summary_matrix(authors, n_queries):
+    '''Summaries of all the authors for each query
 
+    Example:
+        matrix = summary_matrix(authors, len(durations))
+        words_inserted = matrix[iauthor][iquery][2]
+
+    Returns:
+        matrix (list(list(list(int)))): authors x queries x [lines_inserted, lines_deleted, words_inserted, words_deleted]
+    '''
+    if np is not None and len(authors) > 0:
+        # one bincount over all the authors, keyed by (iauthor, iquery)
+        keys = np.concatenate([iauthor * n_queries + np.frombuffer(author.columns.iquery, dtype=np.intc) for iauthor, author in enumerate(authors)])
+        metrics = [np.concatenate([np.frombuffer(column, dtype=np.intc) for column in columns])
+            for columns in zip(*(author.columns.metrics() for author in authors))]
+        return _bincount_matrix(keys, metrics, len(authors) * n_queries).reshape(len(authors), n_queries, 4).tolist()
+    return [author.columns.aggregate(n_queries)[1] for author in authors]
+
+QUERY_TYPES = ('total', 'durations', 'mixed')
+
+def get_reports(config):
+    '''Reports of the config, and their queries
+
+    A "total" config has a total report of its first query, and a "durations"
+    config has a durations report of all its queries. A "mixed" config has both:
+    a total report of its query with "type": "total" (at most one, written to
+    "html total"), and a durations report of its queries with "type": "duration"
+    (the default, written to "html").
+
+    Returns:
+        reports (list(tuple)): (query type, config of the report, iqueries) of each report. The config of the
+            report has its own "query type", "html" and "queries" (config["queries"][iquery] for iquery in iqueries).
+    '''
+    query_type, queries = config['query type'], config['queries']
+    assert query_type in QUERY_TYPES, 'Wrong query type: %s' % (query_type)
+    if query_type == 'total':       return [('total', config, [0])]
+    elif query_type == 'durations': return [('durations', config, list(range(len(queries))))]
+    assert all(query.get('type', 'duration') in ('total', 'duration') for query in queries), 'Wrong type of query'
+    itotal = [iquery for iquery, query in enumerate(queries) if query.get('type', 'duration') == 'total']
+    assert len(itotal) <= 1, 'More than one query with "type": "total" (only one "html total")'
+    idurations = [iquery for iquery, query in enumerate(queries) if query.get('type', 'duration') == 'duration']
+    reports = []
+    if len(itotal) > 0:
+        assert 'html total' in config, 'No "html total" for the total query'
+        reports.append(('total', dict(config, **{'query type': 'total', 'html': config['html total'], 'queries': [queries[itotal[0]]]}), itotal))
+    if len(idurations) > 0:
+        reports.append(('durations', dict(config, **{'query type': 'durations', 'queries': [queries[iquery] for iquery in idurations]}), idurations))
+    return reports
+
+def get_since(config):
+    '''Earliest time of the queries of the reports of the config (to stop walking the commits)'''
+    return min(since for query_type, report_config, iqueries in get_reports(config) for since, until in get_durations(report_config))
+
+def generate_reports(config, repo, commits, cache=None, jobs=1, authors=None):
+    '''Generate the statistics of all the reports of the config (see get_reports()) in one pass
+
+    The commits are walked and diffed once for all the queries of the reports
+    (see dispatch_stats()), then each report takes the stats of its own queries
+    from the same columns (see Author.select()), summarizes them, and checks the
+    diaries if it is a durations report.
+
+    Example:
+        authors, reports = generate_reports(config, repo, walk_commits(repo, get_target(repo)))
+        for query_type, report_config, report_authors in reports:
+            ...
+        # later, the commits after the previous tip
+        authors, reports = generate_reports(config, repo, walk_commits(repo, tip, hide=[old_tip]), authors=authors)
+
+    Args:
+        config (dict): Configurations (any query type)
+        repo (pygit2.Repository):
+        commits (CommitIndex or iterable(pygit2.Commit)): (see dispatch_stats())
+        cache (CommitStatsCache):
+        jobs (int): Number of processes to diff commits
+        authors (list(Author)): Append the commits (newer than the ones appended before) to them, new authors if None
+
+    Returns:
+        authors (list(Author)): Stats of all the queries
+        reports (list(tuple)): (query type, config of the report, list(Author) of the report) of each report
+    '''
+    reports = get_reports(config)
+    durations = get_durations(config)[:max(iquery for query_type, report_config, iqueries in reports for iquery in iqueries) + 1]
+    if authors is None: authors = [Author(info, repo) for info in config['authors']]
+    fake_commits = get_fake_commits(config, repo)
+    n_commits = dispatch_stats(repo, authors, commits, durations, fake_commits, cache=cache, jobs=jobs)
+    print('Totol number of commits:', n_commits)
+    tree = repo[get_target(repo)].tree if repo.is_bare else None # read diaries from blobs if no working tree
+    store = cache.store if cache is not None else None
+    results = []
+    for query_type, report_config, iqueries in reports:
+        print('Report:', query_type)
+        report_authors = authors if iqueries == list(range(len(durations))) else [author.select(iqueries) for author in authors]
+        for author in report_authors:
+            print('Author:', author.name)
+            with metrics.timer('summarize'): author.summarize(len(iqueries))
+            if query_type == 'durations':
+                with metrics.timer('diary'):
+                    author.check_diary(os.path.dirname(config['repository']), [durations[iquery] for iquery in iqueries],
+                        check_file=True, check_content=True, tree=tree, store=store)
+            print('  NC: %d, L+: %d, L-: %d, W+: %d, W-: %d' % (
+                author.n_commits,
+                author.summary.lines_inserted, author.summary.lines_deleted,
+                author.summary.words_inserted, author.summary.words_deleted))
+        results.append((query_type, report_config, report_authors))
+    return authors, results
@@ -0,0 +1,349 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+import os
+import io
+import csv
+import json
+import gzip
+import tempfile
+import contextlib
+from datetime import datetime
+try:
+    import pyarrow # optional, for parquet exports
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# templates of the page (str.format), joined once when imported
+TEMPLATE_HEAD = (
+    '<!DOCTYPE html>'
+    '<html>'
+    '<head>'
+        '<meta charset="utf-8"/>'
+        '<title>{title}</title>'
+        '<link rel="stylesheet" type="text/css" href="https://cdn.datatables.net/1.10.20/css/jquery.dataTables.min.css">'
+        '<link rel="stylesheet" type="text/css" href="https://cdn.datatables.net/buttons/1.6.1/css/buttons.dataTables.min.css">'
+        '<link rel="stylesheet" type="text/css" href="./gitstat_style.css">'
+    '</head>'
+    '<body>'
+        '<header>'
+            '<h1>{title}</h1>'
+            '<p>Updated {tnow_str} from the git repository.</p>'
+        '</header>'
+        '<main>'
+            '<h2>{subtitle}</h2>'
+            '<p>{note}</p>'
+)
+TEMPLATE_TABLE = (
+            '<table id="statistics" class="display">' # rows are loaded from the json in the script
+                '<thead><tr>' # table header
+                    '<th></th>' # column for expand / collapse icon
+                    '{headers}'
+                '</tr></thead>'
+            '</table>'
+)
+TEMPLATE_FOOT = (
+        '</main>'
+        '<footer>'
+            '<p>{footer}</p>'
+        '</footer>'
+        '<script type="text/javascript" charset="utf8" src="https://code.jquery.com/jquery-3.3.1.min.js"></script>'
+        '<script type="text/javascript" charset="utf8" src="https://cdn.datatables.net/1.10.20/js/jquery.dataTables.min.js"></script>'
+        '<script type="text/javascript" charset="utf8" src="https://cdn.datatables.net/buttons/1.6.1/js/dataTables.buttons.min.js"></script>'
+        '<script type="text/javascript" charset="utf8" src="https://cdnjs.cloudflare.com/ajax/libs/jszip/3.1.3/jszip.min.js"></script>'
+        '<script type="text/javascript" charset="utf8" src="https://cdnjs.cloudflare.com/ajax/libs/pdfmake/0.1.53/pdfmake.min.js"></script>'
+        '<script type="text/javascript" charset="utf8" src="https://cdnjs.cloudflare.com/ajax/libs/pdfmake/0.1.53/vfs_fonts.js"></script>'
+        '<script type="text/javascript" charset="utf8" src="https://cdn.datatables.net/buttons/1.6.1/js/buttons.html5.min.js"></script>'
+        '<script type="text/javascript" charset="utf8">'
+            'var rows = {rows}, diaries = {diaries}, files = {files};' # data of the table, urls of the tables of files
+            '$(document).ready(function(){{'
+                # apply datatable
+                'var table = $("#statistics").DataTable({{'
+                    'dom: "Blfrtip",' # https://datatables.net/reference/option/dom
+                    'buttons: ['
+                        '"copyHtml5",'
+                        '{{extend: "excelHtml5", title: "{export_name}"}},'
+                        '{{extend: "csvHtml5", title: "{export_name}"}}'
+                    '],'
+                    'data: rows,'
+                    'deferRender: true,' # create the rows when they are shown
+                    'columnDefs: ['
+                        '{{targets: 0, className: "details-control", orderable: false}},'
+                        '{{targets: {diary_columns},' # columns of queries, marked if no diary
+                            'createdCell: function(td, data, row, irow, icol){{if(!diaries[irow][icol - {diary_column0}]) $(td).addClass("no-diary");}}}}'
+                    '],'
+                    'iDisplayLength: 100{options}'
+                '}});'
+                # click for expand / collapse subtable (load the table of files when it is expanded first time)
+                '$("#statistics").on("click", "td.details-control", function(){{'
+                    'var tr = $(this).closest("tr");'
+                    'var row = table.row(tr);'
+                    'if(row.child.isShown()){{row.child.hide(); tr.removeClass("shown");}}'
+                    'else if(tr.data("child-value")){{row.child(tr.data("child-value")).show(); tr.addClass("shown");}}'
+                    'else{{'
+                        '$.getJSON(files[row.index()], function(details){{'
+                            'var subtable = $("<table>").append("<thead><tr>{file_headers}</tr></thead>");'
+                            'var tbody = $("<tbody>").appendTo(subtable);'
+                            '$.each(details, function(i, detail){{'
+                                'var line = $("<tr>").appendTo(tbody);'
+                                '$.each(detail, function(j, data){{$("<td>").text(data).appendTo(line);}});'
+                            '}});'
+                            'tr.data("child-value", subtable);'
+                            'row.child(subtable).show(); tr.addClass("shown");'
+                        '}});'
+                    '}}'
+                '}});'
+            '}});'
+        '</script>'
+    '</body>'
+    '</html>'
+)
+FILE_HEADERS = ['File name', 'Fake commits', 'Invalid commits', 'Valid commits',
+    'Lines inserted', 'Lines deleted', 'Words inserted', 'Words deleted'] # columns of file_details()
+
+def publish(path, data, compress=False):
+    '''Write data to path atomically (and a gzip-compressed copy path + '.gz', served by "gzip_static on;" of nginx)
+
+    The data is written to a temporary file in the same folder, which then
+    replaces path, so a reader never sees a half-written file.
+
+    Args:
+        path (str):
+        data (bytes):
+        compress (bool):
+    '''
+    with open_atomic(path) as f:
+        f.write(data)
+    if compress:
+        with open_atomic(path + '.gz') as f:
+            f.write(gzip.compress(data, mtime=0)) # same bytes for same data
+
+@contextlib.contextmanager
+def open_atomic(path):
+    '''Open a temporary file (binary) to write, which replaces path when closed without error
+
+    Example:
+        with open_atomic('stats.csv') as f:
+            f.write(...)
+    '''
+    fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.chmod(tmp, 0o644) # mkstemp creates files only readable by the owner
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def write_json(path, obj, compress=False):
+    '''Publish obj as a compact json file'''
+    publish(path, json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8'), compress)
+
+def json_script(obj):
+    '''json of obj to be embedded in <script>'''
+    return json.dumps(obj, separators=(',', ':')).replace('</', '<\\/')
+
+def file_details(author):
+    '''Rows of the table of files of the author (after summarize())
+
+    Returns:
+        rows (list(list)): [filepath, fake commits, invalid commits, valid commits,
+            lines inserted, lines deleted, words inserted, words deleted] for each file
+    '''
+    return [[fstat.filepath, len(fake), len(invalid), len(valid), # distinct commits
+        stat.lines_inserted, stat.lines_deleted, stat.words_inserted, stat.words_deleted]
+        for fstat, stat, (fake, invalid, valid) in zip(author.files.values(), author.summary_files, author.summary_files_commits)]
+
+def write_file_details(out, authors, compress=False):
+    '''Write the tables of files of the authors to json files next to the html (out)
+
+    The files are <name of html>_files/<index of author>.json, loaded by the page
+    only when the row of the author is expanded.
+
+    Returns:
+        urls (list(str)): url of the json file of each author (relative to the html)
+    '''
+    name = os.path.splitext(os.path.basename(out))[0] + '_files'
+    folder = os.path.join(os.path.dirname(out), name)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    urls = []
+    for iauthor, author in enumerate(authors):
+        write_json(os.path.join(folder, '%d.json' % iauthor), file_details(author), compress)
+        urls.append('%s/%d.json' % (name, iauthor))
+    for filename in os.listdir(folder): # authors removed from the config
+        if filename.split('.')[0].isdigit() and int(filename.split('.')[0]) >= len(authors):
+            os.remove(os.path.join(folder, filename))
+    return urls
+
+def render_page(config, headers, rows, files, diaries=None, diary_column0=3, scroll_x=False, tnow=None):
+    '''Render the html of the statistics
+
+    Args:
+        config (dict): Configurations (title, subtitle, note, export)
+        headers (list(str)): Headers of the columns of the table (except the expand / collapse icon)
+        rows (list(list)): Rows of the table, the first element is for the icon ('')
+        files (list(str)): Url of the table of files of each row (see write_file_details())
+        diaries (list(list(bool))): Whether each row has diary in the columns from diary_column0
+        diary_column0 (int): Index of the first column of diaries
+        scroll_x (bool): Scroll the table horizontally
+        tnow (datetime.datetime): Time of the update, now if None
+
+    Returns:
+        html (str):
+    '''
+    tnow = tnow if tnow is not None else datetime.now()
+    n_diary_columns = len(diaries[0]) if diaries else 0
+    return ''.join((
+        TEMPLATE_HEAD.format(
+            title=config['title'],
+            tnow_str=tnow.strftime('%Y-%m-%d %H:%M:%S'),
+            subtitle=config['subtitle'],
+            note=config['note']),
+        TEMPLATE_TABLE.format(
+            headers=''.join('<th>%s</th>' % header for header in headers)),
+        TEMPLATE_FOOT.format(
+            footer='',
+            rows=json_script(rows),
+            diaries=json_script([[1 if has_diary else 0 for has_diary in row] for row in diaries] if diaries else []),
+            files=json_script(files),
+            diary_columns=json_script(list(range(diary_column0, diary_column0 + n_diary_columns))),
+            diary_column0=diary_column0,
+            options=',scrollX: true' if scroll_x else '',
+            # DataTables has bug with scrollX: https://datatables.net/forums/discussion/33283/header-alignment-mismatch-with-scrollx-true
+            file_headers=''.join('<th>%s</th>' % header for header in FILE_HEADERS),
+            export_name=tnow.strftime('%Y%m%d_%H%M%S_') + config['export']),
+    ))
+
+def write_report(config, headers, rows, authors, diaries=None, scroll_x=False):
+    '''Write the html of the statistics to config['html'], with the tables of files of the authors
+
+    Set "gzip": true in the config to write gzip-compressed copies (.gz) as well.
+    See render_page() for the arguments.
+    '''
+    out = config['html']
+    dir = os.path.dirname(out)
+    if dir and not os.path.exists(dir):
+        os.makedirs(dir)
+    compress = config.get('gzip', False)
+    files = write_file_details(out, authors, compress) # before the page which loads them
+    publish(out, render_page(config, headers, rows, files, diaries, scroll_x=scroll_x).encode('utf-8'), compress)
+
+def write_total(config, authors):
+    '''Write the total report of the authors (after summarize()) to config['html']'''
+    headers = ['Authors', 'Semester', 'Fake commits', 'Invalid commits', 'Valid commits',
+        'Lines inserted', 'Lines deleted', 'Words inserted', 'Words deleted', 'Git score']
+    rows = [['', author.name, author.labels[0],
+        author.n_fake_commits,
+        author.n_invalid_commits,
+        author.n_commits,
+        author.summary.lines_inserted,
+        author.summary.lines_deleted,
+        author.summary.words_inserted,
+        author.summary.words_deleted,
+        0] # git score
+        for author in authors]
+    write_report(config, headers, rows, authors)
+    write_exports(config, authors) # csv, jsonl, parquet of "exports"
+
+def write_durations(config, authors):
+    '''Write the durations report of the authors (after summarize() and check_diary()) to config['html']'''
+    headers = (['Authors', 'Semester'] + [query['name'] for query in config['queries']] +
+        ['Fake commits', 'Net<br>lines count', 'Net<br>words count', 'Weeks<br>with commits', 'Diary score', 'Git score'])
+    rows = [['', author.name, author.labels[0]] +
+        [summary.words_inserted+summary.words_deleted for summary in author.summary_duration] + [
+        author.n_fake_commits,
+        author.summary.lines_inserted+author.summary.lines_deleted,
+        author.summary.words_inserted+author.summary.words_deleted,
+        author.queries_with_commits,
+        '{:.2f}'.format(0), # diary score
+        '{:.2f}'.format(0)] # git score
+        for author in authors]
+    write_report(config, headers, rows, authors, diaries=[author.has_diary for author in authors], scroll_x=True)
+    write_exports(config, authors) # csv, jsonl, parquet of "exports"
+
+WRITERS = {'total': write_total, 'durations': write_durations}
+
+def write_reports(reports):
+    '''Write the reports from gitstat.generate_reports()'''
+    for query_type, config, authors in reports:
+        WRITERS[query_type](config, authors)
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+QUERY_COLUMNS = ['author', 'label', 'query', 'since', 'until',
+    'lines_inserted', 'lines_deleted', 'words_inserted', 'words_deleted', 'has_diary']
+FILE_COLUMNS = ['author', 'label', 'filepath', 'fake_commits', 'invalid_commits', 'valid_commits',
+    'lines_inserted', 'lines_deleted', 'words_inserted', 'words_deleted']
+
+def query_records(config, authors):
+    '''Stats of each author and query (after summarize()), rows of QUERY_COLUMNS'''
+    for author in authors:
+        for iquery, (query, stat) in enumerate(zip(config['queries'], author.summary_duration)):
+            yield [author.name, author.labels[0], query['name'], query['since'], query['until'],
+                stat.lines_inserted, stat.lines_deleted, stat.words_inserted, stat.words_deleted,
+                author.has_diary[iquery] if author.has_diary is not None else None]
+
+def file_records(authors):
+    '''Stats of each author and file (after summarize()), rows of FILE_COLUMNS'''
+    for author in authors:
+        for detail in file_details(author):
+            yield [author.name, author.labels[0]] + detail
+
+def write_table(path, fmt, columns, records):
+    '''Write the records (iterable of rows) to a csv, jsonl or parquet file atomically
+
+    csv and jsonl are written row by row; parquet needs pyarrow and collects the columns first.
+
+    Returns:
+        ret (bool): False if the format is not available
+    '''
+    if fmt == 'parquet' and pyarrow is None:
+        print('Skip %s (parquet needs pyarrow)' % (path))
+        return False
+    with open_atomic(path) as f:
+        if fmt == 'csv':
+            text = io.TextIOWrapper(f, encoding='utf-8', newline='')
+            writer = csv.writer(text)
+            writer.writerow(columns)
+            writer.writerows(records)
+            text.detach() # keep f open
+        elif fmt == 'jsonl':
+            text = io.TextIOWrapper(f, encoding='utf-8', newline='\n')
+            for record in records:
+                text.write(json.dumps(dict(zip(columns, record)), ensure_ascii=False))
+                text.write('\n')
+            text.detach()
+        elif fmt == 'parquet':
+            data = [[] for column in columns]
+            for record in records:
+                for values, value in zip(data, record):
+                    values.append(value)
+            pyarrow.parquet.write_table(pyarrow.table(dict(zip(columns, data))), f)
+        else:
+            raise AssertionError('Unknown export format: %s' % (fmt))
+    return True
+
+def write_exports(config, authors):
+    '''Write the stats to files for other programs, next to config['html']
+
+    Formats are set by "exports" in the config (e.g. ["csv", "jsonl", "parquet"]), and
+    each format has two files: <name of html>_queries.<format> (author x query) and
+    <name of html>_files.<format> (author x file).
+
+    Returns:
+        paths (list(str)): Files written
+    '''
+    formats = config.get('exports', [])
+    assert all(fmt in EXPORT_FORMATS for fmt in formats), 'Unknown export format in "exports"'
+    filename = os.path.splitext(config['html'])[0]
+    paths = []
+    for fmt in formats:
+        for name, columns, records in (
+                ('queries', QUERY_COLUMNS, query_records(config, authors)),
+                ('files', FILE_COLUMNS, file_records(authors))):
+            path = '%s_%s.%s' % (filename, name, fmt)
+            if write_table(path, fmt, columns, records):
+                paths.append(path)
+    return paths
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+import gitstat
+import generate, generate_batch
+import pygit2 as git
+import sys, os, time, argparse, contextlib
+from datetime import datetime
+
+class Report:
+    '''Statistics of a config, kept in memory between the updates of its repository'''
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.config = None
+        self.authors = None # stats of all the queries, None if not generated yet (or the config is changed)
+        self.reports = None # from generate.generate()
+        self.tip = None # commit id of the tip of the stats (and the html)
+
+    def load(self):
+        '''Load the config if it is changed (the statistics are generated again)
+
+        If the config cannot be loaded (e.g. half written, or wrong), the
+        exception is raised and the last config and its stats are kept.
+        '''
+        mtime = os.path.getmtime(self.path)
+        if mtime == self.mtime: return False
+        config = gitstat.load_config(self.path)
+        assert config['query type'] in gitstat.QUERY_TYPES, 'Wrong query type in %s' % (self.path)
+        gitstat.get_reports(config) # check the queries
+        self.config, self.mtime = config, mtime
+        self.authors = None
+        return True
+
+    def signature(self):
+        '''What is written to the html (changed if any stats or diary of the authors is changed)'''
+        return [(author.n_commits, author.queries_with_commits, len(author.columns), author.has_diary,
+            len(author.invalid.commits), len(author.fake.commits))
+            for query_type, config, authors in self.reports for author in authors]
+
+class WatchedRepository:
+    '''A repository and its reports, updated when the tip moves
+
+    The statistics of the authors of every report are kept in memory. When the
+    tip moves forward, only the new commits (walked from the new tip, hiding
+    the old one) are diffed and appended to the authors, and only the reports
+    whose html would change are written again (atomically, see report.publish()).
+    The reports are generated from scratch if the new tip is not a descendant
+    of the old one (e.g. force push), if the config is changed, if a new
+    commit renames files which are followed (the older stats are kept with the
+    old paths), or if the update of the report failed (e.g. the html could not
+    be written, after the new commits were appended).
+
+    Example:
+        watched = WatchedRepository('/srv/git/course.git', ['config_total.json', 'config_durations.json'])
+        watched.refresh() # generate all the reports
+        ... # push
+        watched.refresh() # only the new commits
+
+    Args:
+        repo_dir (str): Path of the repository
+        paths (list(str)): Paths of the configs of the repository
+        fetch (bool): Fetch (or pull) from the remote before reading the tip
+        jobs (int): Number of processes to diff commits
+    '''
+    def __init__(self, repo_dir, paths, fetch=False, jobs=1):
+        self.repo_dir = repo_dir
+        self.reports = [Report(path) for path in paths]
+        self.fetch = fetch
+        self.jobs = jobs
+        for report in self.reports: report.load()
+        config = self.reports[0].config
+        self.callbacks = gitstat.get_callbacks(config) if fetch else None
+        self.repo = gitstat.open_repository(config, self.callbacks) if fetch else git.Repository(repo_dir)
+        self.store = gitstat.open_store(config, self.repo)
+        self.caches = dict() # key of DiffFilter -> CommitStatsCache
+
+    def cache(self, config):
+        diff_filter = gitstat.get_diff_filter(config)
+        if diff_filter.key not in self.caches:
+            self.caches[diff_filter.key] = gitstat.CommitStatsCache(store=self.store, diff_filter=diff_filter)
+        return self.caches[diff_filter.key]
+
+    def refresh(self):
+        '''Update the reports to the tip of the repository
+
+        Returns:
+            n (int): Number of reports written
+        '''
+        repo = self.repo
+        if self.fetch:
+            with gitstat.metrics.timer('update'): gitstat.update(repo, callbacks=self.callbacks) # fetch only if bare
+        tip = gitstat.get_target(repo)
+        for report in self.reports:
+            try:
+                report.load()
+            except Exception as e: # e.g. saved while being edited
+                print('Error in %s (the last config is kept): %r' % (report.path, e))
+        stale = [report for report in self.reports if report.authors is None or report.tip != tip]
+        if len(stale) == 0: return 0
+        print('Tip of %s: %s' % (self.repo_dir, tip))
+        # new commits appended to the reports kept in memory, others generated from scratch
+        n = 0
+        pending = []
+        new_indexes = dict() # old tip -> CommitIndex of the new commits
+        try:
+            for report in stale:
+                with self._updating(report):
+                    if report.authors is not None and not repo.descendant_of(tip, report.tip):
+                        print('Not a descendant of the previous tip, generate again:', report.path)
+                        report.authors = None
+                    if report.authors is None:
+                        pending.append(report)
+                        continue
+                    if report.tip not in new_indexes:
+                        with gitstat.metrics.timer('walk'):
+                            new_indexes[report.tip] = gitstat.CommitIndex(gitstat.walk_commits(repo, tip, hide=[report.tip])) # only the new commits
+                        print('New commits since %s: %d' % (report.tip, len(new_indexes[report.tip])))
+                    if self._renames_files(report, new_indexes[report.tip]):
+                        report.authors = None
+                        pending.append(report)
+                        continue
+                    signature = report.signature()
+                    report.authors, report.reports = generate.generate(report.config, repo, new_indexes[report.tip], cache=self.cache(report.config),
+                        jobs=self.jobs, authors=report.authors)
+                    if report.signature() != signature:
+                        self._write(report); n += 1
+                    report.tip = tip
+            if len(pending) > 0:
+                since = min(gitstat.get_since(report.config) for report in pending)
+                with gitstat.metrics.timer('walk'):
+                    index = gitstat.CommitIndex(gitstat.walk_commits(repo, tip, since=since)) # stop at the earliest query
+                for report in pending:
+                    print('Generate:', report.path)
+                    with self._updating(report):
+                        report.authors, report.reports = generate.generate(report.config, repo, index, cache=self.cache(report.config), jobs=self.jobs)
+                        self._write(report); n += 1
+                        report.tip = tip
+        finally:
+            self.store.commit()
+        return n
+
+    @contextlib.contextmanager
+    def _updating(self, report):
+        '''Drop the stats of the report if its update fails (the new commits may be appended already)
+
+        The error is printed and the other reports are updated.
+        '''
+        try:
+            yield
+        except Exception as e:
+            report.authors = None # generated again at the next refresh
+            print('Error in %s (generated again at the next refresh): %r' % (report.path, e))
+        except BaseException:
+            report.authors = None
+            raise
+
+    def _renames_files(self, report, index):
+        '''Whether a new commit renames files which are followed by the report'''
+        cache = self.cache(report.config)
+        if cache.diff_filter is None or not cache.diff_filter.renames: return False
+        return any(filestat[1] == 4 for i in range(len(index)) if index.n_parents[i] == 1
+            for filestat in gitstat.diff_paths(self.repo, self.repo[index.id(i)], cache.diff_filter))
+
+    def _write(self, report):
+        print('Write:', ', '.join(config['html'] for query_type, config, authors in report.reports))
+        with gitstat.metrics.timer('html'): generate.write_html(report.reports)
+
+    def close(self):
+        self.store.close()
+
+def _mtime(path):
+    return os.path.getmtime(path) if path is not None and os.path.exists(path) else None
+
+def wait(seconds, trigger=None, mtime=None):
+    '''Sleep for seconds, or until the trigger file is touched (e.g. by a post-receive hook)
+
+    Args:
+        seconds (float):
+        trigger (str): Path of the trigger file
+        mtime (float): Modified time of the trigger file when it was checked last time
+
+    Returns:
+        mtime (float): Modified time of the trigger file now
+    '''
+    deadline = time.monotonic() + seconds
+    while True:
+        if _mtime(trigger) != mtime or time.monotonic() >= deadline: return _mtime(trigger)
+        time.sleep(min(1, max(0, deadline - time.monotonic())))
+
+if __name__ == '__main__':
+    print(sys.argv[0], 'at', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+    parser = argparse.ArgumentParser(description='Update the statistics when new commits are pushed')
+    parser.add_argument('configs', nargs='+', help='json files of configurations, or folders of them')
+    parser.add_argument('--interval', type=float, default=60, help='seconds between the checks of the tips')
+    parser.add_argument('--trigger', help='file touched to check the tips at once (e.g. by a post-receive hook)')
+    parser.add_argument('--fetch', action='store_true', help='fetch (or pull) from the remotes at every check')
+    parser.add_argument('--jobs', type=int, default=1, help='number of processes to diff commits')
+    parser.add_argument('--once', action='store_true', help='check the tips once and exit')
+    args = parser.parse_args()
+
+    # load configurations, grouped by repository
+    paths = generate_batch.collect_configs(args.configs)
+    groups = generate_batch.group_configs((path, gitstat.load_config(path)) for path in paths)
+    print('Number of configs: %d, repositories: %d' % (len(paths), len(groups)))
+    watched = []
+    for repo_dir, group in groups.items():
+        try:
+            watched.append(WatchedRepository(repo_dir, [path for path, config in group], fetch=args.fetch, jobs=args.jobs))
+        except Exception as e: # watch the others
+            print('Error in %s (not watched): %r' % (repo_dir, e))
+
+    mtime = _mtime(args.trigger)
+    try:
+        while True:
+            for repository in watched:
+                try:
+                    n = repository.refresh()
+                    if n > 0: print('Done: %s (%d reports written) at %s' % (repository.repo_dir, n, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                except Exception as e: # keep watching the others (and this one at the next check)
+                    print('Error in %s: %r' % (repository.repo_dir, e))
+            if args.once: break
+            mtime = wait(args.interval, args.trigger, mtime)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for repository in watched: repository.close()